@@ -1,4 +1,6 @@
 from django.contrib import admin
-from game.models import Question
+from game.models import Category, PlayedGame, Question
 
+admin.site.register(Category)
 admin.site.register(Question)
+admin.site.register(PlayedGame)
@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+from django.conf import settings
+
+
+""" AnswerBatcher - collects answers of all consumers in the process and sends them to game managers in batches """
+
+
+class AnswerBatcher:
+    MAX_BATCH_SIZE = 500
+
+    def __init__(self):
+        self.batches = {}  # {'game manager channel': [answer, ...]}
+
+    async def _send_later(self, channel_layer, channel):
+        await asyncio.sleep(settings.ANSWER_BATCH_DELAY)
+        await self._send(channel_layer, channel)
+
+    async def _send(self, channel_layer, channel):
+        answers = self.batches.pop(channel, None)
+        if answers:
+            await channel_layer.send(
+                channel,
+                {
+                    "type": "submit_answers_batch",
+                    "answers": answers,
+                    "sent_at": time.time(),
+                },
+            )
+
+    async def add(self, channel_layer, channel, answer):
+        answers = self.batches.setdefault(channel, [])
+        answers.append(answer)
+        if len(answers) >= self.MAX_BATCH_SIZE:
+            await self._send(channel_layer, channel)
+        elif len(answers) == 1:
+            # First answer of a batch schedules sending it
+            asyncio.ensure_future(self._send_later(channel_layer, channel))
+
+
+answer_batcher = AnswerBatcher()
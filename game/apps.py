@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class GameConfig(AppConfig):
     name = 'game'
+
+    def ready(self):
+        import game.checks
+        import game.signals
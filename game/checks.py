@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+from game.models import PlayedGame
+
+
+""" System checks of game settings, run by every management command before it starts """
+
+
+@register()
+def check_game_codes(app_configs, **kwargs):
+    errors = []
+    max_length = PlayedGame._meta.get_field('code').max_length
+    # Codes of finished games are saved in game history
+    if not 0 < settings.GAME_CODE_LENGTH <= max_length:
+        errors.append(Error(f"GAME_CODE_LENGTH has to be in range 1-{max_length}",
+                            hint="Longer codes don't fit in PlayedGame.code", id='game.E001'))
+    alphabet = settings.GAME_CODE_ALPHABET
+    if len(alphabet) < 2 or len(set(alphabet)) != len(alphabet):
+        errors.append(Error("GAME_CODE_ALPHABET needs at least 2 characters, each of them once", id='game.E002'))
+    return errors
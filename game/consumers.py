@@ -1,52 +1,127 @@
 import asyncio
 import json
+import logging
 import random
+import time
+from urllib.parse import parse_qs
 
 from asgiref.sync import async_to_sync
 from channels.consumer import SyncConsumer, AsyncConsumer
 from channels.generic.websocket import AsyncWebsocketConsumer, WebsocketConsumer
+from django.conf import settings
+
+from game import metrics
+from game.answer_batcher import answer_batcher
+from game.game_logic import frames
+from game.game_logic.sharding import get_shard_channel, get_shard_for_game_code, is_sharded, shard_load_board
+from game.rate_limit import TokenBucket, limited_requests
+from game.schemas import InvalidRequest, validate
+
+logger = logging.getLogger(__name__)
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        await self.accept()
+        metrics.open_connections.inc()
+        self.game_shard = 0  # Shard of the GameWorker handling player's game
+        self.rate_limit = TokenBucket(settings.CLIENT_REQUESTS_PER_SECOND, settings.CLIENT_REQUESTS_BURST)
+        self.is_rate_limited = False
+        self.answered_questions = set()  # Ids of questions answered in the current game
+        # Clients choose msgpack over binary frames with 'msgpack' subprotocol or ?format=msgpack
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        if frames.MSGPACK_SUBPROTOCOL in self.scope.get('subprotocols', []):
+            self.use_msgpack = True
+            await self.accept(frames.MSGPACK_SUBPROTOCOL)
+        else:
+            self.use_msgpack = query.get('format') == ['msgpack']
+            await self.accept()
+
+    async def _send_to_game_manager(self, message):
+        message['sent_at'] = time.time()  # Used to measure queue lag of the worker
+        await self.channel_layer.send(get_shard_channel(self.game_shard), message)
+
+    def _log_frame(self, prefix, frame):
+        # Only a sample of frames is logged, frames are formatted only when they are logged
+        if logger.isEnabledFor(logging.DEBUG) and random.random() < settings.FRAME_LOG_SAMPLE_RATE:
+            logger.debug('%s %s', prefix, frame)
+
+    async def _switch_shard(self, shard):
+        # Game on the previous shard has to be left explicitly, the new shard doesn't know about it
+        if shard != self.game_shard:
+            await self._send_to_game_manager(
+                {
+                    "type": "remove_user",
+                    "channel_name": self.channel_name,
+                    "silent": True,
+                })
+            self.game_shard = shard
 
     async def _leave_group(self):
-        await self.channel_layer.send(
-            "game-manager",
+        await self._send_to_game_manager(
             {
                 "type": "remove_user",
                 "channel_name": self.channel_name,
             })
 
     async def disconnect(self, close_code):
-        await self._leave_group()
+        metrics.open_connections.dec()
+        # Player's slot is kept for a while, so the client can reconnect and resume the game
+        await self._send_to_game_manager(
+            {
+                "type": "remove_user",
+                "channel_name": self.channel_name,
+                "disconnected": True,
+            })
 
     async def receive(self, text_data=None, bytes_data=None):
-        if text_data is None:
+        metrics.frames_received.inc()
+        # Requests over the limit are dropped before decoding, client is told once per burst
+        if not self.rate_limit.consume():
+            limited_requests.inc(reason='rate')
+            if not self.is_rate_limited:
+                self.is_rate_limited = True
+                await self._send_frame(frames.error("Too many requests"))
+            return
+        self.is_rate_limited = False
+
+        if self.use_msgpack and bytes_data is not None:
+            text_data_json = frames.decode_binary(bytes_data)
+        elif text_data is not None:
+            try:
+                text_data_json = json.loads(text_data)
+            except ValueError:
+                text_data_json = None
+        else:
             return
 
-        text_data_json = json.loads(text_data)
-        request_type = text_data_json.get('type', None)
-        if not request_type:
+        # Invalid requests are answered here and never reach the game manager
+        try:
+            request_type, data = validate(text_data_json)
+        except InvalidRequest as e:
+            await self._send_frame(frames.error(e.msg))
             return
 
-        print('Received: ' + str(text_data_json))
+        self._log_frame('Received:', text_data_json)
+        if request_type in ('new_game', 'join', 'resume', 'watch'):
+            self.answered_questions.clear()
         if request_type == 'new_game':
-            username = text_data_json.get('user', None)
-            await self.channel_layer.send(
-                "game-manager",
+            username = data['user']
+            if is_sharded():
+                await self._switch_shard(await shard_load_board.get_least_loaded_shard())
+            await self._send_to_game_manager(
                 {
                     "type": "create_game",
                     "channel_name": self.channel_name,
                     "username": username,
+                    "category": data['category'],
+                    "difficulty": data['difficulty'],
                 },
             )
         elif request_type == 'join':
-            username = text_data_json.get('user', None)
-            game_code = text_data_json.get('game_code', None)
-            await self.channel_layer.send(
-                "game-manager",
+            username = data['user']
+            game_code = data['game_code']
+            await self._switch_shard(get_shard_for_game_code(game_code))
+            await self._send_to_game_manager(
                 {
                     "type": "add_user",
                     "game_code": game_code,
@@ -54,80 +129,104 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     "username": username,
                 },
             )
+        elif request_type == 'resume':
+            game_code = data['game_code']
+            await self._switch_shard(get_shard_for_game_code(game_code))
+            await self._send_to_game_manager(
+                {
+                    "type": "resume_session",
+                    "game_code": game_code,
+                    "channel_name": self.channel_name,
+                    "session": data['session'],
+                },
+            )
+        elif request_type == 'watch':
+            game_code = data['game_code']
+            await self._switch_shard(get_shard_for_game_code(game_code))
+            await self._send_to_game_manager(
+                {
+                    "type": "add_spectator",
+                    "game_code": game_code,
+                    "channel_name": self.channel_name,
+                },
+            )
         elif request_type == 'start':
-            await self.channel_layer.send(
-                "game-manager",
+            await self._send_to_game_manager(
                 {
                     "type": "start_game",
                     "channel_name": self.channel_name,
                 },
             )
         elif request_type == 'answer':
-            answer = text_data_json.get('answer', None)
-            question_id = text_data_json.get('question_id', None)
-            await self.channel_layer.send(
-                "game-manager",
+            answer = data['answer']
+            question_id = data['question_id']
+            # Only the first accepted answer to a question counts, repeats don't reach the game manager
+            if question_id in self.answered_questions:
+                limited_requests.inc(reason='repeated_answer')
+                return
+            self.answered_questions.add(question_id)
+            answer_event = {
+                "type": "submit_answer",
+                "channel_name": self.channel_name,
+                "question_id": question_id,
+                "answer": answer,
+                "time": time.time(),  # Answers are scored by the time they were received, not processed
+            }
+            if settings.ANSWER_BATCH_DELAY:
+                await answer_batcher.add(self.channel_layer, get_shard_channel(self.game_shard), answer_event)
+            else:
+                await self._send_to_game_manager(answer_event)
+        elif request_type == 'users':
+            await self._send_to_game_manager(
                 {
-                    "type": "submit_answer",
+                    "type": "send_users",
                     "channel_name": self.channel_name,
-                    "question_id": question_id,
-                    "answer": answer,
                 },
             )
         elif request_type == 'leave':
             await self._leave_group()
 
+    async def _send_frame(self, frame):
+        if self.use_msgpack:
+            await self.send(bytes_data=frames.encode_binary(frame))
+        else:
+            await self.send(text_data=frames.encode(frame))
+
+    async def broadcast(self, event):
+        # Frame was encoded once by the game for the whole group
+        if self.use_msgpack:
+            await self.send(bytes_data=event['bytes'])
+        else:
+            await self.send(text_data=event['text'])
+
     async def game_created(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'game_created',
-            'code': event['game_code']
-        }))
+        await self._send_frame(frames.game_created(event['game_code']))
 
     async def join_successful(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'join_successful',
-            'username': event['username']
-        }))
+        await self._send_frame(frames.join_successful(event['username'], event.get('session')))
 
     async def error(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'error',
-            'msg': event['msg']
-        }))
+        # Answers rejected by the game, e.g. sent before the question started, may be sent again
+        self.answered_questions.discard(event.get('question_id'))
+        await self._send_frame(frames.error(event['msg']))
 
     async def game_started(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'game_started',
-        }))
+        await self._send_frame(frames.game_started())
 
     async def ask_question(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'question',
-            'question_id': event['question_id'],
-            'time': event['time'],
-            'question': event['question'],
-            'answers': event['answers'],
-        }))
+        await self._send_frame(frames.question(event['question_id'], event['time'], event['question'],
+                                               event['answers']))
 
     async def show_users(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'users_list',
-            'users': event['users']
-        }))
+        await self._send_frame(frames.users_list(event['users']))
 
     async def question_end(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'question_end',
-            'question_id': event['question_id'],
-            'correct_answer': event['correct_answer'],
-        }))
+        await self._send_frame(frames.question_end(event['question_id'], event['correct_answer']))
 
     async def game_ended(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'quiz_end',
-            'scores': event['scores'],
-        }))
+        await self._send_frame(frames.quiz_end(event['scores']))
 
     async def send(self, text_data=None, bytes_data=None, close=False):
-        print('Sent: ' + text_data)
+        metrics.frames_sent.inc()
+        self._log_frame('Sent:', text_data if text_data is not None else bytes_data)
         await super().send(text_data, bytes_data, close)
@@ -0,0 +1,154 @@
+import json
+
+import msgpack
+
+
+""" Frames - messages sent to the clients over WebSocket, as JSON text or msgpack binary frames """
+
+MSGPACK_SUBPROTOCOL = 'msgpack'
+
+
+def game_created(game_code):
+    return {
+        'type': 'game_created',
+        'code': game_code,
+    }
+
+
+def join_successful(username, session=None):
+    frame = {
+        'type': 'join_successful',
+        'username': username,
+    }
+    # Token sent with 'resume' request after a reconnect
+    if session is not None:
+        frame['session'] = session
+    return frame
+
+
+def error(msg):
+    return {
+        'type': 'error',
+        'msg': msg,
+    }
+
+
+def watch_successful(game_code):
+    return {
+        'type': 'watch_successful',
+        'code': game_code,
+    }
+
+
+def game_started():
+    return {
+        'type': 'game_started',
+    }
+
+
+def question(question_id, time, content, answers):
+    return {
+        'type': 'question',
+        'question_id': question_id,
+        'time': time,
+        'question': content,
+        'answers': answers,
+    }
+
+
+def users_list(users, version=None):
+    frame = {
+        'type': 'users_list',
+        'users': users,
+    }
+    if version is not None:
+        frame['version'] = version
+    return frame
+
+
+def users_delta(from_version, version, joined, left):
+    return {
+        'type': 'users_delta',
+        'from_version': from_version,
+        'version': version,
+        'joined': joined,
+        'left': left,
+    }
+
+
+def question_end(question_id, correct_answer):
+    return {
+        'type': 'question_end',
+        'question_id': question_id,
+        'correct_answer': correct_answer,
+    }
+
+
+def answer_reveal(question_id, answer):
+    # Sent to spectators instead of per-player question_end
+    return {
+        'type': 'answer_reveal',
+        'question_id': question_id,
+        'answer': answer,
+    }
+
+
+def leaderboard(question_id, top):
+    return {
+        'type': 'leaderboard',
+        'question_id': question_id,
+        'top': top,
+    }
+
+
+def session_resumed(game_code, username, phase, time_left, score, rank, question=None):
+    """ Snapshot of the game sent to a reconnected player, question is (question_id, content, answers, answered) """
+    frame = {
+        'type': 'session_resumed',
+        'code': game_code,
+        'username': username,
+        'phase': phase,
+        'time_left': time_left,
+        'score': score,
+        'rank': rank,
+    }
+    if question is not None:
+        question_id, content, answers, answered = question
+        frame['question'] = {
+            'question_id': question_id,
+            'question': content,
+            'answers': answers,
+            'answered': answered,
+        }
+    return frame
+
+
+def quiz_end(scores):
+    return {
+        'type': 'quiz_end',
+        'scores': scores,
+    }
+
+
+def encode(frame):
+    return json.dumps(frame)
+
+
+def encode_binary(frame):
+    return msgpack.packb(frame, use_bin_type=True)
+
+
+def decode_binary(data):
+    try:
+        return msgpack.unpackb(data, raw=False)
+    except (ValueError, msgpack.UnpackException):
+        return None
+
+
+def broadcast_event(frame):
+    # Group messages carry the frame encoded once in both formats, every consumer forwards it as it is
+    return {
+        'type': 'broadcast',
+        'text': encode(frame),
+        'bytes': encode_binary(frame),
+    }
@@ -1,169 +1,540 @@
 import asyncio
+import functools
+import secrets
 import time
 
-from asgiref.sync import sync_to_async
-from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from django.conf import settings
 
+from game import metrics
+from game.game_logic import frames
+from game.game_logic.leaderboard import Leaderboard
 from game.game_logic.player import Player
-from game.models import Question
+from game.game_logic.question_pool import question_pool
+from game.game_logic.usernames import UsernameIndex
 
 
 class Game:
     QUESTION_LENGTH = 10
+    BREAK_LENGTH = 5  # Time between the end of a question and the next one
     MAX_SCORE = 1000
     MIN_SCORE = 100
+    QUESTIONS_AMOUNT = 3
+    LEADERBOARD_SIZE = 10  # Number of best players sent after every question
+    USERS_UPDATE_DELAY = 0.5  # Joins and leaves within this time are sent as one users_delta
 
-    def __init__(self, game_code, channel_layer, on_game_end):
+    def __init__(self, game_code, channel_layer, on_game_end, scheduler, store, history, category_id=None,
+                 difficulty=None):
         self.game_code = game_code
         self.channel_layer = channel_layer
         self.on_game_end = on_game_end
-        self.players = {}
-        self.running_game_task = None
+        self.scheduler = scheduler
+        self.store = store
+        self.history = history
+        self.category_id = category_id  # Questions are drawn from the category and difficulty, None means any
+        self.difficulty = difficulty
+        # Players are kept by their ids, channel names are mapped to ids only once
+        self.players = {}  # {player_id: Player}
+        self.player_ids = {}  # {channel_name: player_id}
+        self.next_player_id = 0
+        self.usernames = UsernameIndex()
+        self.sessions = {}  # {session token: player_id}
+        self.disconnected_players = set()  # Ids of players who may still resume their sessions
+        self.spectators = set()  # Channel names, spectators are not players and have their own group
+        self.spectators_group = f"{game_code}.spectators"
+        self.spectator_events = {}  # {kind: event} waiting for the next spectators broadcast
+        self.spectators_sent_at = 0.0
+        self.last_activity = time.monotonic()  # Time of the last join, leave or phase change
+        self.leaderboard = Leaderboard(self.MAX_SCORE * self.QUESTIONS_AMOUNT)
+        self.is_running = False
+        self.is_finished = False
+        self.questions = []
+        self.question_events = []  # Pre-encoded question frames, sent without any work when a question starts
+        self.reveal_events = []  # Pre-encoded correct answers for spectators
+        self.questions_lock = asyncio.Lock()
+        self.are_questions_prepared = False
         self.current_question = None
+        self.users_version = 0
+        self.joined_players = []  # Ids of players not announced to the group yet
+        self.left_usernames = []
+        self.unstored_answers = []  # [(channel_name, question_id, score), ...]
+        self.started_at = None
+        self.played_answers = []  # [(username, question_id, answer, score, answer_time), ...] saved in game history
 
 # Private:
 
-    def _is_username_available(self, username):
-        return False if username in self.players.values() else True
+    def _create_player(self, channel_name, username):
+        player = Player(self.next_player_id, channel_name, username, self.QUESTIONS_AMOUNT)
+        self.next_player_id += 1
+        self.players[player.player_id] = player
+        self.player_ids[channel_name] = player.player_id
+        self.leaderboard.add(player.player_id)
+        return player
 
-    def _get_available_username(self, username):
-        if not self._is_username_available(username):
-            index = 1
-            while not self._is_username_available(username + f" #{index}"):
-                index += 1
-            username = username + f" #{index}"
-        return username
+    def _get_player(self, channel_name):
+        return self.players[self.player_ids[channel_name]]
 
     def _get_all_scores(self):
-        return [{'user': p.username, 'score': p.total_score()} for p in self.players.values()]
+        return [{'user': p.username, 'score': self.leaderboard.get_score(p.player_id)} for p in self.players.values()]
+
+    def _get_top_players(self):
+        return [{'user': self.players[player_id].username, 'score': score, 'rank': rank}
+                for player_id, score, rank in self.leaderboard.get_top(self.LEADERBOARD_SIZE)]
 
     def _get_all_usernames(self):
         return [p.username for p in self.players.values()]
 
-    async def _send_list_of_users(self):
-        await self.channel_layer.group_send(
-            self.game_code,
-            {
-                "type": "show_users",
-                "users": self._get_all_usernames(),
-            },
-        )
-
-    async def _send_error(self, channel_name, msg):
+    async def _send_list_of_users(self, channel_name):
         await self.channel_layer.send(
             channel_name,
-            {
-                "type": "error",
-                "msg": msg,
-            },
+            frames.broadcast_event(frames.users_list(self._get_all_usernames(), self.users_version)),
         )
 
-    async def _ask_question(self, game_code, question, question_id):
-        self.current_question = {'id': question_id, 'correct_answer': question.correct_answer,
-                                            'length': self.QUESTION_LENGTH, 'start_time': time.time()}
+    def _schedule_users_update(self):
+        if not self.scheduler.is_scheduled((self.game_code, 'users')):
+            self.scheduler.schedule((self.game_code, 'users'), time.monotonic() + self.USERS_UPDATE_DELAY,
+                                    self._send_users_update)
+
+    async def _send_users_update(self):
+        # Players already in the group get only the changes, new players get the whole list
+        self.scheduler.cancel((self.game_code, 'users'))
+        joined_players, self.joined_players = self.joined_players, []
+        left_usernames, self.left_usernames = self.left_usernames, []
+        if not joined_players and not left_usernames:
+            return
+        self.users_version += 1
         await self.channel_layer.group_send(
-            game_code,
-            {
-                'type': 'ask_question',
-                'question_id': question_id,
-                'time': self.QUESTION_LENGTH,
-                'question': question.content,
-                'answers': question.answers
-            }
+            self.game_code,
+            frames.broadcast_event(frames.users_delta(self.users_version - 1, self.users_version,
+                                                      [self.players[i].username for i in joined_players],
+                                                      left_usernames)),
         )
+        for player_id in joined_players:
+            channel_name = self.players[player_id].channel_name
+            await self.channel_layer.group_add(self.game_code, channel_name)
+            await self._send_list_of_users(channel_name)
+
+    async def _send_to_spectators(self, kind, event):
+        # Spectators get at most one broadcast per interval, later events of the same kind replace waiting ones
+        if not self.spectators:
+            return
+        self.spectator_events[kind] = event
+        if self.scheduler.is_scheduled((self.game_code, 'spectators')):
+            return
+        send_time = self.spectators_sent_at + settings.SPECTATOR_BROADCAST_INTERVAL
+        if send_time <= time.monotonic():
+            await self._flush_spectator_events()
+        else:
+            self.scheduler.schedule((self.game_code, 'spectators'), send_time, self._flush_spectator_events)
 
-        await asyncio.sleep(self.QUESTION_LENGTH)
+    async def _flush_spectator_events(self):
+        self.scheduler.cancel((self.game_code, 'spectators'))
+        events, self.spectator_events = self.spectator_events, {}
+        self.spectators_sent_at = time.monotonic()
+        for event in events.values():
+            await self.channel_layer.group_send(self.spectators_group, event)
+
+    async def _send_error(self, channel_name, msg, question_id=None):
+        event = {
+            "type": "error",
+            "msg": msg,
+        }
+        if question_id is not None:
+            # Rejected answer, the consumer lets the player answer the question again
+            event["question_id"] = question_id
+        await self.channel_layer.send(channel_name, event)
+
+    def _save_answer(self, channel_name, question_id, answer, received_at):
+        """ Scores and saves the answer, returns an error message if it was rejected """
+        if not self.current_question:
+            return "There is no active question"
+        if question_id != self.current_question['id']:
+            return "Wrong question id"
+        # Clocks of server processes may differ slightly
+        answer_time = max(received_at - self.current_question['start_time'], 0)
+        if answer_time > self.current_question['length']:
+            return "There is no active question"
+        # Calculate score
+        score = 0
+        if self.current_question['correct_answer'] == answer:
+            score = int((1 - answer_time/self.current_question['length']) *
+                        (self.MAX_SCORE-self.MIN_SCORE) + self.MIN_SCORE)
+        # Save answer
+        player = self._get_player(channel_name)
+        if player.set_answer(question_id, score):
+            self.leaderboard.add_score(player.player_id, score)
+            self.unstored_answers.append((channel_name, question_id, score))
+            self.played_answers.append((player.username, question_id, answer, score, answer_time))
+
+    async def _store_answers(self):
+        answers, self.unstored_answers = self.unstored_answers, []
+        if answers:
+            await self.store.save_answers(self.game_code, answers)
+
+    async def _save_state(self, phase, question_id=None, deadline=None):
+        state = {'phase': phase, 'users_version': self.users_version}
+        if self.questions:
+            state['questions'] = ','.join(str(q.id) for q in self.questions)
+        if question_id is not None:
+            state['question_id'] = question_id
+        if deadline is not None:
+            # Stored deadlines are wall clock time, monotonic clocks of processes differ
+            state['deadline'] = time.time() + deadline - time.monotonic()
+        if self.current_question:
+            state['start_time'] = self.current_question['start_time']
+        if self.started_at is not None:
+            state['started_at'] = self.started_at
+        if self.category_id is not None:
+            state['category_id'] = self.category_id
+        if self.difficulty is not None:
+            state['difficulty'] = self.difficulty
+        await self.store.save_game(self.game_code, state)
+
+    def _schedule(self, deadline, callback, *args):
+        # Phases still running when the game was abandoned don't schedule the next ones
+        if not self.is_finished:
+            self.scheduler.schedule((self.game_code, 'phase'), deadline, functools.partial(callback, *args))
+
+    async def _finish(self):
+        if self.is_finished:
+            return
+        self.is_finished = True
+        self.scheduler.cancel((self.game_code, 'phase'))
+        self.scheduler.cancel((self.game_code, 'users'))
+        self.scheduler.cancel((self.game_code, 'questions'))
+        self.scheduler.cancel((self.game_code, 'spectators'))
+        await self.on_game_end(self.game_code)
+
+    async def _start_question(self, question_id, deadline):
+        self.last_activity = time.monotonic()
+        self.current_question = {'id': question_id, 'correct_answer': self.questions[question_id].correct_answer,
+                                 'length': self.QUESTION_LENGTH, 'start_time': time.time()}
+        await self.channel_layer.group_send(self.game_code, self.question_events[question_id])
+        await self._send_to_spectators('question', self.question_events[question_id])
+        await self._save_state('question', question_id, deadline + self.QUESTION_LENGTH)
+        # Next deadlines are counted from the previous ones, so delays of the scheduler don't accumulate
+        self._schedule(deadline + self.QUESTION_LENGTH, self._end_question, question_id,
+                       deadline + self.QUESTION_LENGTH)
+
+    async def _end_question(self, question_id, deadline):
+        self.last_activity = time.monotonic()
         self.current_question = None
-        for player_channel in self.players:
-            await self.channel_layer.send(
-                player_channel,
-                {
-                    'type': 'question_end',
-                    'question_id': question_id,
-                    'correct_answer': self.players[player_channel].is_answer_correct(question_id),
-                }
-            )
+        await self._send_question_results(question_id)
+        leaderboard_event = frames.broadcast_event(frames.leaderboard(question_id, self._get_top_players()))
+        await self.channel_layer.group_send(self.game_code, leaderboard_event)
+        await self._send_to_spectators('reveal', self.reveal_events[question_id])
+        await self._send_to_spectators('leaderboard', leaderboard_event)
+        await self._save_state('break', question_id, deadline + self.BREAK_LENGTH)
+        self._schedule_after_break(question_id, deadline + self.BREAK_LENGTH)
+
+    def _schedule_after_break(self, question_id, deadline):
+        if question_id + 1 < len(self.questions):
+            self._schedule(deadline, self._start_question, question_id + 1, deadline)
+        else:
+            self._schedule(deadline, self._end_game)
+
+    async def _send_question_results(self, question_id):
+        # There are only two possible results, both are encoded once
+        results = {
+            correct: frames.broadcast_event(frames.question_end(question_id, correct))
+            for correct in (True, False)
+        }
+        players = iter(list(self.players.values()))
+        errors = []
+
+        async def sender():
+            for player in players:
+                if player.player_id in self.disconnected_players:
+                    continue
+                try:
+                    await self.channel_layer.send(player.channel_name, results[player.is_answer_correct(question_id)])
+                except ChannelFull:
+                    metrics.undelivered_results.inc(reason='channel_full')
+                    print(f"Game {self.game_code}: result not delivered to {player.channel_name}, channel is full")
+                except Exception as e:
+                    # E.g. Redis connection errors, a failed send must not stop the game before its next phase
+                    metrics.undelivered_results.inc(reason='error')
+                    errors.append(e)
+
+        # Fixed number of senders share one iterator, so at most QUESTION_END_SEND_CONCURRENCY sends are in flight
+        start_time = time.monotonic()
+        await asyncio.gather(*[sender() for _ in range(min(settings.QUESTION_END_SEND_CONCURRENCY,
+                                                            len(self.players)))])
+        fan_out_time = time.monotonic() - start_time
+        metrics.results_fan_out.observe(fan_out_time)
+        if errors:
+            print(f"Game {self.game_code}: results of question {question_id} not delivered to {len(errors)} players: "
+                  f"{errors[0]!r}")
+        if fan_out_time > self.BREAK_LENGTH * settings.QUESTION_END_FAN_OUT_WARNING_RATIO:
+            print(f"Game {self.game_code}: sending results of question {question_id} to {len(self.players)} "
+                  f"players took {fan_out_time:.2f}s of {self.BREAK_LENGTH}s break")
 
     async def _get_random_questions(self, amount):
-        questions = await database_sync_to_async(Question.objects.all().order_by)('?')
-        random_questions = await sync_to_async(list)(questions[:amount])
-        return random_questions
+        return await question_pool.get_random_questions(amount, self.category_id, self.difficulty)
+
+    def _encode_questions(self):
+        self.question_events = [
+            frames.broadcast_event(frames.question(question_id, self.QUESTION_LENGTH, question.content,
+                                                   question.answers))
+            for question_id, question in enumerate(self.questions)
+        ]
+        self.reveal_events = [
+            frames.broadcast_event(frames.answer_reveal(question_id, question.correct_answer))
+            for question_id, question in enumerate(self.questions)
+        ]
+
+    async def _prepare_questions(self):
+        # Called in the lobby, the start of the game waits only if the questions are still loading
+        self.scheduler.cancel((self.game_code, 'questions'))
+        async with self.questions_lock:
+            if not self.are_questions_prepared:
+                self.questions = await self._get_random_questions(self.QUESTIONS_AMOUNT)
+                self._encode_questions()
+                self.are_questions_prepared = True
+                if not self.is_running:
+                    # Resumed lobby keeps its questions and their category
+                    await self._save_state('lobby')
 
     async def _run_game(self):
-        await self.channel_layer.group_send(
-            self.game_code,
-            {
-                'type': 'game_started',
-            }
-        )
+        self.last_activity = time.monotonic()
+        await self._prepare_questions()
+        self.started_at = time.time()
+        # Players who joined just before the start have to be in the group
+        await self._send_users_update()
+        game_started_event = frames.broadcast_event(frames.game_started())
+        await self.channel_layer.group_send(self.game_code, game_started_event)
+        await self._send_to_spectators('game', game_started_event)
 
-        questions = await self._get_random_questions(3)
+        if self.questions:
+            deadline = time.monotonic()
+            self._schedule(deadline, self._start_question, 0, deadline)
+        else:
+            await self._end_game()
 
-        for i, q in enumerate(questions):
-            await self._ask_question(self.game_code, q, i)
-            await asyncio.sleep(5)
+    def _get_phase(self):
+        if not self.is_running:
+            return 'lobby'
+        return 'question' if self.current_question else 'break'
 
-        await self.channel_layer.group_send(
-            self.game_code,
-            {
-                'type': 'game_ended',
-                'scores': self._get_all_scores()
-            }
+    def _get_snapshot(self, player):
+        deadline = self.scheduler.get_deadline((self.game_code, 'phase'))
+        question = None
+        if self.current_question:
+            question_id = self.current_question['id']
+            question = (question_id, self.questions[question_id].content, self.questions[question_id].answers,
+                        player.scores[question_id] >= 0)
+        return frames.session_resumed(
+            self.game_code, player.username, self._get_phase(),
+            max(deadline - time.monotonic(), 0) if deadline is not None and self.is_running else None,
+            self.leaderboard.get_score(player.player_id), self.leaderboard.get_rank(player.player_id), question,
         )
-        await self.on_game_end(self.game_code)
+
+    def _move_player(self, player, channel_name):
+        # Scores, session and the place in the users update are kept by the player id
+        del self.player_ids[player.channel_name]
+        player.channel_name = channel_name
+        self.player_ids[channel_name] = player.player_id
+        self.disconnected_players.discard(player.player_id)
+
+    def _get_history_record(self):
+        return {
+            'code': self.game_code,
+            'started_at': self.started_at or time.time(),
+            'finished_at': time.time(),
+            'players_amount': len(self.players),
+            'questions': [q.id for q in self.questions],
+            'answers': self.played_answers,
+        }
+
+    async def _end_game(self):
+        quiz_end_event = frames.broadcast_event(frames.quiz_end(self._get_all_scores()))
+        await self.channel_layer.group_send(self.game_code, quiz_end_event)
+        # Last broadcast of spectators is not throttled, the game is removed right after it
+        if self.spectators:
+            self.spectator_events['game'] = quiz_end_event
+            await self._flush_spectator_events()
+        # Written to the database later by the history writer, the game only queues it
+        self.history.add(self._get_history_record())
+        await self._finish()
 
 # Public:
 
+    def prepare_questions(self):
+        # Questions are loaded and encoded by the scheduler while players are joining
+        self.scheduler.schedule((self.game_code, 'questions'), time.monotonic(), self._prepare_questions)
+
+    def get_rank(self, channel_name):
+        return self.leaderboard.get_rank(self.player_ids[channel_name])
+
+    async def send_list_of_users(self, channel_name):
+        # Requested by clients which missed a users_delta
+        if self.player_ids.get(channel_name) in self.joined_players:
+            await self._send_users_update()
+        else:
+            await self._send_list_of_users(channel_name)
+
     async def remove_player(self, channel_name):
-        self.players.pop(channel_name)
+        self.last_activity = time.monotonic()
+        player = self.players.pop(self.player_ids.pop(channel_name))
+        self.leaderboard.remove(player.player_id)
+        self.usernames.remove(player.username)
+        self.sessions.pop(player.session, None)
+        self.disconnected_players.discard(player.player_id)
+        await self.store.delete_player(self.game_code, channel_name)
         await self.channel_layer.group_discard(self.game_code, channel_name)
 
         if len(self.players) == 0:
-            if self.running_game_task:
-                self.running_game_task.cancel()
-            await self.on_game_end(self.game_code)
+            await self._finish()
             return
 
-        # Send updated list of users attending the game
-        await self._send_list_of_users()
+        # Send updated list of users attending the game, players not announced yet just disappear
+        if player.player_id in self.joined_players:
+            self.joined_players.remove(player.player_id)
+        else:
+            self.left_usernames.append(player.username)
+        self._schedule_users_update()
 
     async def add_player(self, channel_name, username):
-        if self.running_game_task:
+        if self.is_running:
             await self._send_error(channel_name, 'Game is running already')
             return
-        new_username = self._get_available_username(username)
-        self.players[channel_name] = Player(channel_name, username)
+        if len(self.players) >= settings.MAX_PLAYERS_PER_GAME:
+            await self._send_error(channel_name, 'Game is full')
+            return
+        self.last_activity = time.monotonic()
+        new_username = self.usernames.add(username)
+        player = self._create_player(channel_name, new_username)
+        player.session = secrets.token_urlsafe(16)
+        self.sessions[player.session] = player.player_id
+        await self.store.save_player(self.game_code, channel_name, new_username)
         await self.channel_layer.send(
             channel_name,
             {
                 "type": "join_successful",
                 "username": new_username,
+                "session": player.session,
             },
         )
-        await self.channel_layer.group_add(self.game_code, channel_name)
-        await self._send_list_of_users()
+        # Player is added to the group with the next users update
+        self.joined_players.append(player.player_id)
+        self._schedule_users_update()
         return new_username
 
-    async def submit_answer(self, channel_name, question_id, answer):
-        if not self.current_question:
-            await self._send_error(channel_name, "There is no active question")
-            return
-        if question_id != self.current_question['id']:
-            await self._send_error(channel_name, "Wrong question id")
-            return
-        answer_time = time.time() - self.current_question['start_time']
-        if answer_time > self.current_question['length']:
-            await self._send_error(channel_name, "There is no active question")
-        # Calculate score
-        score = 0
-        if self.current_question['correct_answer'] == answer:
-            score = int((1 - answer_time/self.current_question['length']) *
-                        (self.MAX_SCORE-self.MIN_SCORE) + self.MIN_SCORE)
-        # Save answer
-        self.players[channel_name].set_answer(question_id, score)
+    def is_expired(self, now, lobby_ttl):
+        """ Lobbies expire when nobody joins or leaves for lobby_ttl, running games when no phase is scheduled """
+        if not self.is_running:
+            return now - self.last_activity > lobby_ttl
+        return (not self.scheduler.is_scheduled((self.game_code, 'phase')) and
+                now - self.last_activity > settings.STALLED_GAME_TTL)
+
+    async def expire(self):
+        for channel_name in list(self.player_ids) + list(self.spectators):
+            await self._send_error(channel_name, "Game expired")
+        await self._finish()
+
+    async def add_spectator(self, channel_name):
+        self.spectators.add(channel_name)
+        await self.channel_layer.group_add(self.spectators_group, channel_name)
+        await self.channel_layer.send(channel_name, frames.broadcast_event(frames.watch_successful(self.game_code)))
+        # Spectators joining during a question see it at once, unless it is waiting for the next broadcast
+        if self.current_question and 'question' not in self.spectator_events:
+            await self.channel_layer.send(channel_name, self.question_events[self.current_question['id']])
+
+    async def remove_spectator(self, channel_name):
+        self.spectators.discard(channel_name)
+        await self.channel_layer.group_discard(self.spectators_group, channel_name)
+
+    async def disconnect_player(self, channel_name):
+        # Player keeps the slot and the score, but nothing is sent to the closed connection
+        self.disconnected_players.add(self.player_ids[channel_name])
+        await self.channel_layer.group_discard(self.game_code, channel_name)
+
+    async def resume_session(self, channel_name, session):
+        """ Moves player of the session to a new connection, returns the previous channel name or None """
+        player_id = self.sessions.get(session)
+        if player_id is None:
+            await self._send_error(channel_name, "Session expired")
+            return None
+        player = self.players[player_id]
+        old_channel_name = player.channel_name
+        self._move_player(player, channel_name)
+        # The room sees no change, only the resumed player gets the snapshot of the game
+        await self.channel_layer.group_discard(self.game_code, old_channel_name)
+        if player_id not in self.joined_players:
+            await self.channel_layer.group_add(self.game_code, channel_name)
+        await self.channel_layer.send(channel_name, frames.broadcast_event(self._get_snapshot(player)))
+        await self.store.delete_player(self.game_code, old_channel_name)
+        await self.store.save_player(self.game_code, channel_name, player.username)
+        await self.store.save_answers(self.game_code, [(channel_name, question_id, score)
+                                                       for question_id, score in enumerate(player.scores)
+                                                       if score >= 0])
+        return old_channel_name
+
+    async def submit_answer(self, channel_name, question_id, answer, received_at=None):
+        error = self._save_answer(channel_name, question_id, answer, received_at or time.time())
+        await self._store_answers()
+        if error:
+            await self._send_error(channel_name, error, question_id)
+
+    async def submit_answers(self, answers):
+        # Whole batch is scored before any error is sent
+        errors = [(a['channel_name'], a['question_id'],
+                   self._save_answer(a['channel_name'], a['question_id'], a['answer'], a['time']))
+                  for a in answers if a['channel_name'] in self.player_ids]
+        await self._store_answers()
+        for channel_name, question_id, error in errors:
+            if error:
+                await self._send_error(channel_name, error, question_id)
 
     async def start_game(self, channel_name):
-        if not self.running_game_task:
-            self.running_game_task = asyncio.create_task(self._run_game())
+        if not self.is_running:
+            self.is_running = True
+            await self._save_state('starting')
+            # Questions are loaded by the scheduler, not in the worker's message handler
+            self._schedule(time.monotonic(), self._run_game)
         else:
             await self._send_error(channel_name, "Game is running already")
+
+    async def resume(self, stored):
+        """ Restores the game saved in the state store by another worker and schedules its next phase """
+        state = stored['state']
+        self.users_version = int(state.get('users_version', 0))
+        if state.get('category_id'):
+            self.category_id = int(state['category_id'])
+        if state.get('difficulty'):
+            self.difficulty = int(state['difficulty'])
+        for channel_name, username in stored['players'].items():
+            self._create_player(channel_name, self.usernames.add(username))
+            # Players who joined just before the previous worker stopped may be missing in the group
+            await self.channel_layer.group_add(self.game_code, channel_name)
+        for question_id, channel_name, score in stored['answers']:
+            if channel_name not in self.player_ids:
+                continue
+            player = self._get_player(channel_name)
+            if player.set_answer(int(question_id), score):
+                self.leaderboard.add_score(player.player_id, score)
+                # Answers and their times are not stored, history of the game keeps only their scores
+                self.played_answers.append((player.username, int(question_id), None, score, None))
+        if state.get('started_at'):
+            self.started_at = float(state['started_at'])
+        if state.get('questions'):
+            self.questions = await question_pool.get_questions([int(i) for i in state['questions'].split(',')])
+            self._encode_questions()
+            self.are_questions_prepared = True
+
+        phase = state.get('phase', 'lobby')
+        if phase == 'lobby':
+            self.prepare_questions()
+            return
+        self.is_running = True
+        if phase == 'starting' or not self.questions:
+            self._schedule(time.monotonic(), self._run_game)
+            return
+        question_id = int(state['question_id'])
+        deadline = time.monotonic() + float(state['deadline']) - time.time()
+        if phase == 'question':
+            self.current_question = {'id': question_id, 'correct_answer': self.questions[question_id].correct_answer,
+                                     'length': self.QUESTION_LENGTH, 'start_time': float(state['start_time'])}
+            self._schedule(deadline, self._end_question, question_id, deadline)
+        else:
+            self._schedule_after_break(question_id, deadline)
@@ -0,0 +1,120 @@
+import collections
+import math
+import random
+
+from django.conf import settings
+
+
+""" Game codes - codes of games drawn from a configurable alphabet, allocated in O(1) """
+
+
+def _inverse(value, modulus):
+    # Modular inverse by extended Euclid (pow(value, -1, modulus) needs Python 3.8)
+    old_r, r, old_s, s = value, modulus, 1, 0
+    while r:
+        quotient = old_r // r
+        old_r, r = r, old_r - quotient * r
+        old_s, s = s, old_s - quotient * s
+    return old_s % modulus
+
+
+class GameCodeSpace:
+    """
+    Bijection between indexes 0..size-1 and codes of `length` characters of `alphabet`.
+    Consecutive indexes are spread over the whole space by an affine permutation, so games created one after
+    another don't get neighbouring codes. All processes build the same permutation from settings, so every
+    process can tell the index of a code - shards own residue classes of indexes.
+    """
+
+    def __init__(self, alphabet, length):
+        self.alphabet = alphabet
+        self.length = length
+        self.positions = {char: position for position, char in enumerate(alphabet)}
+        self.size = len(alphabet) ** length
+        self.multiplier = int(self.size * 0.6180339887) or 1
+        while math.gcd(self.multiplier, self.size) != 1:
+            self.multiplier += 1
+        self.inverse_multiplier = _inverse(self.multiplier, self.size)
+        self.offset = self.size // 3
+
+    def get_code(self, index):
+        value = (index * self.multiplier + self.offset) % self.size
+        chars = []
+        for _ in range(self.length):
+            value, position = divmod(value, len(self.alphabet))
+            chars.append(self.alphabet[position])
+        return ''.join(reversed(chars))
+
+    def get_index(self, code):
+        """ Returns index of the code or None if it is not a valid code """
+        if not isinstance(code, str) or len(code) != self.length:
+            return None
+        value = 0
+        for char in code:
+            position = self.positions.get(char)
+            if position is None:
+                return None
+            value = value * len(self.alphabet) + position
+        return (value - self.offset) * self.inverse_multiplier % self.size
+
+
+class GameCodeAllocator:
+    """
+    Codes of one shard - indexes shard, shard + shard_count, ... of the code space. Fresh codes are taken
+    from a counter starting at a random index, so a restarted worker doesn't hand out codes which clients
+    may still remember. Released codes are reused, oldest first, only when all fresh codes are taken.
+    """
+
+    def __init__(self, code_space, shard, shard_count):
+        self.code_space = code_space
+        self.shard = shard
+        self.shard_count = shard_count
+        self.capacity = len(range(shard, code_space.size, shard_count))
+        self.start = random.randrange(self.capacity) if self.capacity else 0
+        self.issued = 0  # Number of codes taken from the counter
+        self.released = collections.deque()
+        self.in_use = set()
+
+# Private:
+
+    def _next_fresh_code(self):
+        while self.issued < self.capacity:
+            step = (self.start + self.issued) % self.capacity
+            self.issued += 1
+            code = self.code_space.get_code(self.shard + step * self.shard_count)
+            # Codes reserved by resumed games are skipped
+            if code not in self.in_use:
+                return code
+        return None
+
+# Public:
+
+    def allocate(self):
+        """ Returns a free code or None if all codes of the shard are in use """
+        code = self._next_fresh_code()
+        # Released code of a resumed game may have been taken from the counter again in the meantime
+        while code is None or code in self.in_use:
+            if not self.released:
+                return None
+            code = self.released.popleft()
+        self.in_use.add(code)
+        return code
+
+    def reserve(self, code):
+        # Codes of games resumed from a state store
+        self.in_use.add(code)
+
+    def release(self, code):
+        if code in self.in_use:
+            self.in_use.remove(code)
+            self.released.append(code)
+
+
+_code_space = None
+
+
+def get_code_space():
+    global _code_space
+    if _code_space is None:
+        _code_space = GameCodeSpace(settings.GAME_CODE_ALPHABET, settings.GAME_CODE_LENGTH)
+    return _code_space
@@ -1,7 +1,18 @@
-import random
+import asyncio
+import functools
+import time
 
 from channels.consumer import AsyncConsumer
+from django.conf import settings
+
+from game import metrics
 from game.game_logic.game import Game
+from game.game_logic.game_codes import GameCodeAllocator, get_code_space
+from game.game_logic.history import history_writer
+from game.game_logic.question_pool import question_pool
+from game.game_logic.scheduler import GameScheduler
+from game.game_logic.sharding import get_shard_count, get_shard_for_channel, is_sharded, shard_load_board
+from game.game_logic.state_store import get_lease_owner, get_lease_store, get_state_store
 
 
 """ GameWorker - manages all active games """
@@ -14,17 +25,70 @@ class GameWorker(AsyncConsumer):
         super().__init__(*args, **kwargs)
         self.active_games = {}
         self.current_players = {}  # {'player_channel_name': 'game_code', ...}
-        print('GameWorker started.')
+        self.current_spectators = {}  # {'spectator_channel_name': 'game_code', ...}
+        self.scheduler = GameScheduler()
+        self.store = get_state_store()
+        self.leases = get_lease_store()
+        self.is_started = False
+        self.has_lease = False
+        self.is_draining = False
+        self.handoff_channel = None  # Hand-off channel of a standby worker, known when it is waiting for the lease
+        self.shard = get_shard_for_channel(self.scope['channel'])
+        self.game_codes = GameCodeAllocator(get_code_space(), self.shard, get_shard_count())
+        print(f'GameWorker started (shard {self.shard} of {get_shard_count()}).')
 
 # Private:
 
-    def _get_new_game_code(self):
-        while True:
-            code = random.randint(0, 99)
-            if not self.active_games.get(code, None):
-                return str(code)
+    async def _start(self):
+        # Worker is created with the first message on its channel
+        self.channel_layer = metrics.TimedChannelLayer(self.channel_layer)
+        self._schedule_sweep()
+        # Pool is shared by workers of the process, ids are loaded in the background - handlers never wait for them
+        if not question_pool.loaded and not question_pool.is_loading:
+            question_pool.load()
+
+    async def _resume_games(self):
+        for stored in await self.store.load_games(self.shard):
+            game_code = stored['game_code']
+            if game_code in self.active_games:
+                # Game handed off to this worker while it was a standby, it is running here already
+                continue
+            game = Game(game_code, self.channel_layer, self._remove_game, self.scheduler, self.store, history_writer)
+            await game.resume(stored)
+            if not game.player_ids:
+                await self.store.delete_game(self.shard, game_code)
+                continue
+            self.active_games[game_code] = game
+            self.game_codes.reserve(game_code)
+            for channel_name in game.player_ids:
+                self.current_players[channel_name] = game_code
+            print(f"Resumed game {game_code}")
+        await self._report_load()
+
+    async def _keep_lease(self):
+        # Lease is taken by rungameworker command, standby workers wait until it expires
+        owner, channel = get_lease_owner(), self.scope['channel']
+        interval = settings.GAME_WORKER_LEASE_TTL / 3
+        refreshed_at = time.monotonic()
+        while self.has_lease:
+            try:
+                if not await self.leases.refresh_lease(channel, owner, settings.GAME_WORKER_LEASE_TTL):
+                    break
+                refreshed_at = time.monotonic()
+            except Exception as e:
+                # Lease stays valid for its TTL after the last refresh, it is retried until then
+                print(f"Lease of {channel} not refreshed: {e!r}")
+                if time.monotonic() + interval >= refreshed_at + settings.GAME_WORKER_LEASE_TTL:
+                    break
+            await asyncio.sleep(interval)
+        if self.has_lease:
+            # Standby may take the channel now, two workers never consume it together - rungameworker exits
+            print(f"Lease of {channel} lost")
+            self.has_lease = False
+            await self.send({"type": "worker.lease_lost"})
 
     async def _remove_player_from_game(self, channel_name):
+        self.scheduler.cancel(('session', channel_name))
         game_code = self.current_players[channel_name]
         await self.active_games[game_code].remove_player(channel_name)
         del self.current_players[channel_name]
@@ -33,40 +97,188 @@ class GameWorker(AsyncConsumer):
         if await self.active_games[game_code].add_player(channel_name, username):
             self.current_players[channel_name] = game_code
 
+    async def _remove_spectator_from_game(self, channel_name):
+        game_code = self.current_spectators.pop(channel_name)
+        await self.active_games[game_code].remove_spectator(channel_name)
+
+    def _schedule_sweep(self):
+        self.scheduler.schedule('sweep', time.monotonic() + settings.GAME_SWEEP_INTERVAL, self._sweep)
+
+    async def _sweep(self):
+        # Idle lobbies and stalled games are removed with their players, spectators and groups
+        self._schedule_sweep()
+        now = time.monotonic()
+        # Draining worker doesn't wait long for lobbies which may never start
+        lobby_ttl = settings.DRAINING_LOBBY_TTL if self.is_draining else settings.IDLE_LOBBY_TTL
+        for game in [game for game in self.active_games.values() if game.is_expired(now, lobby_ttl)]:
+            print(f"Game {game.game_code} expired")
+            await game.expire()
+
+    async def _expire_session(self, channel_name):
+        # Player didn't reconnect within the grace period
+        if channel_name in self.current_players:
+            await self._remove_player_from_game(channel_name)
+
     async def _remove_game(self, game_code):
         print(f"Removing game {game_code}")
-        players = self.active_games[game_code].players
+        players = self.active_games[game_code].player_ids
         for p in players:
             await self.channel_layer.group_discard(game_code, p)
             del self.current_players[p]
+        for spectator in self.active_games[game_code].spectators:
+            await self.channel_layer.group_discard(self.active_games[game_code].spectators_group, spectator)
+            del self.current_spectators[spectator]
         self.active_games.pop(game_code)
+        self.game_codes.release(game_code)
+        await self.store.delete_game(self.shard, game_code)
+        await self._report_load()
+        await self._check_drained()
+
+    async def _report_drain_progress(self):
+        print(f"Draining shard {self.shard}: {len(self.active_games)} games, {len(self.current_players)} players, "
+              f"{len(self.current_spectators)} spectators left")
+        self.scheduler.schedule('drain', time.monotonic() + settings.DRAIN_REPORT_INTERVAL,
+                                self._report_drain_progress)
+
+    async def _check_drained(self):
+        if self.is_draining and not self.active_games:
+            print(f"Shard {self.shard} drained")
+            self.scheduler.cancel('drain')
+            self.has_lease = False
+            await self.leases.release_lease(self.scope['channel'], get_lease_owner())
+            # Tells rungameworker command to stop the process
+            await self.send({"type": "worker.drained"})
+
+    def _is_handled_here(self, message):
+        """ Whether the message belongs to a game of this worker, other messages go to the standby while draining """
+        if message['type'] == 'create_game':
+            return False
+        if message['type'] in ('add_user', 'resume_session', 'add_spectator'):
+            return message['game_code'] in self.active_games
+        if 'channel_name' in message:
+            return message['channel_name'] in self.current_players or message['channel_name'] in self.current_spectators
+        return True
+
+    async def _hand_off(self, message):
+        # Player moving to a game of the standby worker leaves the game here
+        if message['channel_name'] in self.current_players:
+            await self._remove_player_from_game(message['channel_name'])
+        if message['channel_name'] in self.current_spectators:
+            await self._remove_spectator_from_game(message['channel_name'])
+        if message['type'] == 'create_game':
+            # Codes of games created by the standby are allocated here, so they don't collide with draining games
+            message = dict(message, game_code=self.game_codes.allocate())
+        await self.channel_layer.send(self.handoff_channel, message)
+
+    async def _report_load(self):
+        if is_sharded():
+            await shard_load_board.report(self.shard, len(self.active_games))
+
+    async def _send_error(self, channel_name, msg, question_id=None):
+        event = {
+            "type": "error",
+            "msg": msg,
+        }
+        if question_id is not None:
+            # Rejected answer, the consumer lets the player answer the question again
+            event["question_id"] = question_id
+        await self.channel_layer.send(channel_name, event)
+
+    async def dispatch(self, message):
+        if not self.is_started:
+            self.is_started = True
+            await self._start()
+        if self.is_draining and self.handoff_channel and not self._is_handled_here(message):
+            await self._hand_off(message)
+            return
+        if 'sent_at' in message:
+            metrics.queue_lag.observe(max(time.time() - message['sent_at'], 0))
+        with metrics.handler_latency.time(handler=message['type']):
+            await super().dispatch(message)
+        metrics.worker_messages.inc(handler=message['type'])
+
+# Public (available via channel layer):
 
-    async def _send_error(self, channel_name, msg):
+    async def report_metrics(self, event):
+        # Metrics endpoint of the server process collects metrics of all workers
+        metrics.active_games.set(len(self.active_games))
+        metrics.active_players.set(len(self.current_players))
+        metrics.active_spectators.set(len(self.current_spectators))
         await self.channel_layer.send(
-            channel_name,
+            event['reply_channel'],
             {
-                "type": "error",
-                "msg": msg,
+                "type": "metrics",
+                "families": metrics.registry.collect(shard=self.shard),
             },
         )
 
-# Public (available via channel layer):
+    async def resume_games(self, event):
+        # Sent by rungameworker command when the worker gets the lease of the channel
+        if not self.has_lease:
+            self.has_lease = True
+            await self._resume_games()
+            asyncio.ensure_future(self._keep_lease())
+
+    async def worker_standby(self, event):
+        # Sent by a standby worker waiting for the lease, e.g. a new release started during a deploy
+        self.handoff_channel = event['handoff_channel']
+
+    async def drain(self, event):
+        # Sent by rungameworker command on SIGTERM: running games are finished, new ones go to the standby worker
+        if not self.is_draining:
+            self.is_draining = True
+            await self._report_drain_progress()
+        await self._check_drained()
 
     async def create_game(self, event):
         channel_name = event['channel_name']
         username = event['username']
-        game_code = self._get_new_game_code()
 
         # Data validation
         if not username:
             await self._send_error(channel_name, "Some data is missing!")
             return
+        if len(self.active_games) >= settings.MAX_GAMES_PER_WORKER:
+            await self._send_error(channel_name, "Too many games, try again later")
+            return
+        if self.is_draining:
+            await self._send_error(channel_name, "Server is restarting, try again in a moment")
+            return
+        if not question_pool.loaded:
+            await self._send_error(channel_name, "Questions are loading, try again in a moment")
+            return
+        category_id = None
+        if event.get('category'):
+            category_id = question_pool.get_category_id(event['category'])
+            if category_id is None:
+                await self._send_error(channel_name, "Unknown category")
+                return
+        difficulty = event.get('difficulty')
+        if question_pool.count_questions(category_id, difficulty) < Game.QUESTIONS_AMOUNT:
+            await self._send_error(channel_name, "Not enough questions for this category and difficulty")
+            return
+        # Every shard allocates codes from its own part of the code space, so codes never collide between shards
+        if event.get('game_code'):
+            # Game handed off by the draining worker
+            game_code = event['game_code']
+            self.game_codes.reserve(game_code)
+        else:
+            game_code = self.game_codes.allocate()
+        if game_code is None:
+            await self._send_error(channel_name, "Too many games, try again later")
+            return
         # Drop player from a game if is playing already
         if channel_name in self.current_players:
             await self._remove_player_from_game(channel_name)
+        if channel_name in self.current_spectators:
+            await self._remove_spectator_from_game(channel_name)
 
         # Create game
-        self.active_games[game_code] = Game(game_code, self.channel_layer, self._remove_game)
+        self.active_games[game_code] = Game(game_code, self.channel_layer, self._remove_game, self.scheduler,
+                                            self.store, history_writer, category_id, difficulty)
+        self.active_games[game_code].prepare_questions()
+        await self.store.register_game(self.shard, game_code)
+        await self._report_load()
         await self.channel_layer.send(
             channel_name,
             {
@@ -91,6 +303,8 @@ class GameWorker(AsyncConsumer):
                 await self._send_error(channel_name, 'You are in this game already')
                 return
             await self._remove_player_from_game(channel_name)
+        if channel_name in self.current_spectators:
+            await self._remove_spectator_from_game(channel_name)
         if game_code not in self.active_games:  # If game does not exist
             await self._send_error(channel_name, f"Game with code {game_code} does not exist")
             return
@@ -101,20 +315,74 @@ class GameWorker(AsyncConsumer):
     async def remove_user(self, event):
         channel_name = event['channel_name']
 
+        if channel_name in self.current_spectators:
+            await self._remove_spectator_from_game(channel_name)
+            return
+
         # Data validation
         if channel_name not in self.current_players:
-            await self._send_error(channel_name, "You are not in a game")
+            # Silent removals are sent when a player moves to a game on another shard
+            if not event.get('silent', False) and not event.get('disconnected', False):
+                await self._send_error(channel_name, "You are not in a game")
+            return
+
+        # Dropped connections keep the player in the game for the grace period
+        if event.get('disconnected', False) and settings.SESSION_GRACE_PERIOD:
+            await self.active_games[self.current_players[channel_name]].disconnect_player(channel_name)
+            self.scheduler.schedule(('session', channel_name), time.monotonic() + settings.SESSION_GRACE_PERIOD,
+                                    functools.partial(self._expire_session, channel_name))
             return
 
         # Remove player from a game
         await self._remove_player_from_game(channel_name)
 
+    async def add_spectator(self, event):
+        channel_name = event['channel_name']
+        game_code = event['game_code']
+
+        # Data validation
+        if game_code not in self.active_games:
+            await self._send_error(channel_name, f"Game with code {game_code} does not exist")
+            return
+        # Spectator leaves a game played or watched before
+        if channel_name in self.current_players:
+            await self._remove_player_from_game(channel_name)
+        if channel_name in self.current_spectators:
+            await self._remove_spectator_from_game(channel_name)
+
+        # Add spectator to the game, players and scores don't change
+        self.current_spectators[channel_name] = game_code
+        await self.active_games[game_code].add_spectator(channel_name)
+
+    async def resume_session(self, event):
+        channel_name = event['channel_name']
+        game_code = event['game_code']
+
+        # Data validation
+        if channel_name in self.current_players:
+            if self.current_players[channel_name] == game_code:
+                await self._send_error(channel_name, 'You are in this game already')
+                return
+            await self._remove_player_from_game(channel_name)
+        if channel_name in self.current_spectators:
+            await self._remove_spectator_from_game(channel_name)
+        if game_code not in self.active_games:
+            await self._send_error(channel_name, f"Game with code {game_code} does not exist")
+            return
+
+        # Move player to the new connection
+        old_channel_name = await self.active_games[game_code].resume_session(channel_name, event['session'])
+        if old_channel_name is not None:
+            self.scheduler.cancel(('session', old_channel_name))
+            del self.current_players[old_channel_name]
+            self.current_players[channel_name] = game_code
+
     async def submit_answer(self, event):
         channel_name = event['channel_name']
 
         # Data validation
         if channel_name not in self.current_players:
-            await self._send_error(channel_name, "You are not in a game")
+            await self._send_error(channel_name, "You are not in a game", event['question_id'])
             return
         # TODO: Better error messages
         try:
@@ -130,7 +398,25 @@ class GameWorker(AsyncConsumer):
 
         # Submit answer
         game_code = self.current_players[channel_name]
-        await self.active_games[game_code].submit_answer(channel_name, question_id, answer)
+        await self.active_games[game_code].submit_answer(channel_name, question_id, answer, event.get('time'))
+
+    async def submit_answers_batch(self, event):
+        # Answers buffered by a server process, validated by consumers. Every game scores its answers in one pass.
+        answers_by_game = {}
+        handed_off_answers = []
+        for answer in event['answers']:
+            game_code = self.current_players.get(answer['channel_name'])
+            if game_code is None:
+                if self.is_draining and self.handoff_channel:
+                    handed_off_answers.append(answer)
+                else:
+                    await self._send_error(answer['channel_name'], "You are not in a game", answer['question_id'])
+                continue
+            answers_by_game.setdefault(game_code, []).append(answer)
+        for game_code, answers in answers_by_game.items():
+            await self.active_games[game_code].submit_answers(answers)
+        if handed_off_answers:
+            await self.channel_layer.send(self.handoff_channel, dict(event, answers=handed_off_answers))
 
     async def start_game(self, event):
         channel_name = event['channel_name']
@@ -143,3 +429,36 @@ class GameWorker(AsyncConsumer):
         # Start game
         game_code = self.current_players[channel_name]
         await self.active_games[game_code].start_game(channel_name)
+
+    async def send_users(self, event):
+        channel_name = event['channel_name']
+
+        # Data validation
+        if channel_name not in self.current_players:
+            await self._send_error(channel_name, "You are not in a game")
+            return
+
+        game_code = self.current_players[channel_name]
+        await self.active_games[game_code].send_list_of_users(channel_name)
+
+    async def question_changed(self, event):
+        # Sent by Question model signals
+        if event['deleted']:
+            question_pool.remove(event['question_id'])
+        else:
+            question_pool.add(event['question_id'], event.get('category_id'), event.get('difficulty'))
+        if self.is_draining and self.handoff_channel:
+            await self.channel_layer.send(self.handoff_channel, event)
+
+    async def category_changed(self, event):
+        # Sent by Category model signals, names of categories are looked up without the database
+        question_pool.change_category(event['category_id'], event['name'], event['deleted'])
+        if self.is_draining and self.handoff_channel:
+            await self.channel_layer.send(self.handoff_channel, event)
+
+    async def questions_imported(self, event):
+        # Sent by import_questions command, bulk inserts don't send Question model signals. Games are created from
+        # the current ids until the new ones are loaded.
+        question_pool.load()
+        if self.is_draining and self.handoff_channel:
+            await self.channel_layer.send(self.handoff_channel, event)
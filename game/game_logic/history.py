@@ -0,0 +1,92 @@
+import asyncio
+import collections
+import datetime
+import uuid
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from game import metrics
+from game.models import PlayedAnswer, PlayedGame, Question
+
+
+""" GameHistoryWriter - saves finished games in the database in batches, outside of games' handlers """
+
+dropped_games = metrics.registry.counter('game_history_dropped_games_total',
+                                         'Finished games not saved because the history queue was full')
+saved_games = metrics.registry.counter('game_history_saved_games_total', 'Finished games saved in the database')
+
+
+def _to_datetime(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
+
+
+class GameHistoryWriter:
+    def __init__(self, max_queue_size, batch_size, flush_interval):
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size  # Games written in one transaction
+        self.flush_interval = flush_interval
+        self.queue = collections.deque()  # Records of finished games, see Game._get_history_record
+        self._task = None
+
+# Private:
+
+    def _take_batch(self):
+        batch = []
+        while self.queue and len(batch) < self.batch_size:
+            batch.append(self.queue.popleft())
+        return batch
+
+    def _write(self, records):
+        # Questions deleted during the game are not referenced
+        existing_questions = set(Question.objects.filter(
+            id__in={question_id for record in records for question_id in record['questions']}
+        ).values_list('id', flat=True))
+        games, answers = [], []
+        for record in records:
+            game = PlayedGame(id=uuid.uuid4(), code=record['code'], started_at=_to_datetime(record['started_at']),
+                              finished_at=_to_datetime(record['finished_at']),
+                              players_amount=record['players_amount'], questions_amount=len(record['questions']))
+            games.append(game)
+            for username, question_index, answer, score, answer_time in record['answers']:
+                question_id = record['questions'][question_index]
+                answers.append(PlayedAnswer(game=game,
+                                            question_id=question_id if question_id in existing_questions else None,
+                                            question_index=question_index, username=username, answer=answer,
+                                            answer_time=answer_time, score=score))
+        with transaction.atomic():
+            PlayedGame.objects.bulk_create(games)
+            PlayedAnswer.objects.bulk_create(answers, batch_size=1000)
+        saved_games.inc(len(games))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            while self.queue:
+                batch = self._take_batch()
+                try:
+                    await database_sync_to_async(self._write)(batch)
+                except Exception as e:
+                    print(f"History of {len(batch)} games not saved: {e!r}")
+
+# Public:
+
+    def add(self, record):
+        """ Queues record of a finished game, never waits for the database """
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        if len(self.queue) >= self.max_queue_size:
+            dropped_games.inc()
+            print(f"History queue is full, game {record['code']} is not saved")
+            return
+        self.queue.append(record)
+
+    def flush(self):
+        """ Writes all queued games, called synchronously when the worker stops """
+        while self.queue:
+            self._write(self._take_batch())
+
+
+history_writer = GameHistoryWriter(settings.GAME_HISTORY_QUEUE_SIZE, settings.GAME_HISTORY_BATCH_SIZE,
+                                   settings.GAME_HISTORY_FLUSH_INTERVAL)
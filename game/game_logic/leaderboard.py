@@ -0,0 +1,88 @@
+import itertools
+
+""" Leaderboard - running totals of players with ranks, every update and query is O(log max_score) """
+
+
+class Leaderboard:
+    def __init__(self, max_score):
+        self.max_score = max_score
+        self.tree = [0] * (max_score + 2)  # Fenwick tree, number of players with each total score
+        self.scores = {}  # {key: total score}
+        self.buckets = {}  # {score: {key, ...}}
+
+# Private:
+
+    def _update_tree(self, score, delta):
+        index = score + 1
+        while index < len(self.tree):
+            self.tree[index] += delta
+            index += index & -index
+
+    def _count_up_to(self, score):
+        count = 0
+        index = score + 1
+        while index > 0:
+            count += self.tree[index]
+            index -= index & -index
+        return count
+
+    def _find_kth_lowest(self, k):
+        # Binary lifting over the tree, returns the score of the k-th lowest player (1-based)
+        index = 0
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            if index + step < len(self.tree) and self.tree[index + step] < k:
+                index += step
+                k -= self.tree[index]
+            step >>= 1
+        return index
+
+    def _insert(self, key, score):
+        self.scores[key] = score
+        self.buckets.setdefault(score, set()).add(key)
+        self._update_tree(score, 1)
+
+    def _delete(self, key):
+        score = self.scores.pop(key)
+        bucket = self.buckets[score]
+        bucket.discard(key)
+        if not bucket:
+            del self.buckets[score]
+        self._update_tree(score, -1)
+        return score
+
+# Public:
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __contains__(self, key):
+        return key in self.scores
+
+    def add(self, key, score=0):
+        self._insert(key, score)
+
+    def remove(self, key):
+        if key in self.scores:
+            self._delete(key)
+
+    def add_score(self, key, points):
+        score = self._delete(key) + points
+        self._insert(key, min(max(score, 0), self.max_score))
+
+    def get_score(self, key):
+        return self.scores[key]
+
+    def get_rank(self, key):
+        # Players with the same score share the rank: 1, 2, 2, 4, ...
+        return len(self.scores) - self._count_up_to(self.scores[key]) + 1
+
+    def get_top(self, amount):
+        """ Returns [(key, score, rank), ...] of the best players, ordered by rank """
+        top = []
+        while len(top) < min(amount, len(self.scores)):
+            rank = len(top) + 1
+            score = self._find_kth_lowest(len(self.scores) - rank + 1)
+            # Only the last bucket can be cut, a tie of many players is not copied whole
+            top.extend((key, score, rank) for key in itertools.islice(self.buckets[score], amount - len(top)))
+        return top
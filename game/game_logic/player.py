@@ -1,19 +1,28 @@
+from array import array
+
+NO_ANSWER = -1
+
 
 class Player:
-    def __init__(self, channel_name, username):
+    # Rooms may have thousands of players - no attribute dict, scores in a preallocated array
+    __slots__ = ('player_id', 'channel_name', 'username', 'scores', 'session')
+
+    def __init__(self, player_id, channel_name, username, questions_amount):
+        self.player_id = player_id  # Number of the player in the game
         self.channel_name = channel_name
         self.username = username
-        self.scores = {}  # self.answers[question_id] = score
+        self.scores = array('i', [NO_ANSWER]) * questions_amount  # self.scores[question_id] = score
+        self.session = None  # Token which lets the player resume the game from another connection
 
     def set_answer(self, question_id, score):
-        if not self.scores.get(question_id, None):
+        # Answers scored 0 don't block the next answer to the question
+        if self.scores[question_id] <= 0:
             self.scores[question_id] = score
             return True
         return False
 
     def total_score(self):
-        return sum(self.scores.values())
+        return sum(score for score in self.scores if score > 0)
 
     def is_answer_correct(self, question_id):
-        return True if self.scores.get(question_id, 0) > 0 else False
-
+        return True if self.scores[question_id] > 0 else False
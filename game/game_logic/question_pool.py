@@ -0,0 +1,196 @@
+import asyncio
+import bisect
+import collections
+import random
+from array import array
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from game.models import Category, Question
+
+
+""" QuestionPool - ids of questions kept in worker memory, so random questions are drawn without sorting the table """
+
+
+LOAD_RETRY_INTERVAL = 5  # Seconds between attempts to load ids when the database is not available
+
+
+class QuestionPool:
+    def __init__(self, recent_size):
+        # Ids of all questions grouped by (category_id, difficulty), so filtered games sample only the matching
+        # groups. Groups are sorted arrays of 4 byte ids - millions of questions take a few MB.
+        self.groups = collections.defaultdict(lambda: array('i'))
+        self.categories = {}  # {category name: category_id}
+        self.recent_size = recent_size
+        self.recent_ids = collections.deque()  # Questions served lately, skipped while there are enough others
+        self.recent_id_set = set()
+        self.loaded = False
+        self.is_loading = False
+        self.load_requested = False
+        self.pending_changes = []  # [(change, args), ...] received while ids are loaded, see _change
+        self.load_task = None
+
+# Private:
+
+    @staticmethod
+    def _find(groups, question_id):
+        """ Returns (group, index in the group) of the question or (None, None) """
+        for group, ids in groups.items():
+            index = bisect.bisect_left(ids, question_id)
+            if index < len(ids) and ids[index] == question_id:
+                return group, index
+        return None, None
+
+    @classmethod
+    def _add(cls, groups, categories, question_id, category_id, difficulty):
+        # Questions are added and edited one at a time in the admin, moving ids in an array is cheap enough
+        group = (category_id, difficulty)
+        current_group, _ = cls._find(groups, question_id)
+        if current_group == group:
+            return
+        if current_group is not None:
+            # Question moved to another category or difficulty
+            cls._remove(groups, categories, question_id)
+        ids = groups[group]
+        ids.insert(bisect.bisect_left(ids, question_id), question_id)
+
+    @classmethod
+    def _remove(cls, groups, categories, question_id):
+        group, index = cls._find(groups, question_id)
+        if group is not None:
+            del groups[group][index]
+
+    @staticmethod
+    def _change_category(groups, categories, category_id, name, deleted):
+        for old_name in [old_name for old_name, old_id in categories.items() if old_id == category_id]:
+            del categories[old_name]
+        if not deleted:
+            categories[name] = category_id
+            return
+        # Questions of a deleted category are left without a category
+        for (group_category_id, difficulty) in [group for group in groups if group[0] == category_id]:
+            ids = groups.pop((group_category_id, difficulty))
+            groups[(None, difficulty)] = array('i', sorted(groups[(None, difficulty)] + ids))
+
+    def _change(self, change, *args):
+        # Ids loaded right now may be read before the change was committed, it is applied again to them
+        if self.is_loading:
+            self.pending_changes.append((change, args))
+        # Changes before the first load are read by the load
+        if self.loaded:
+            change(self.groups, self.categories, *args)
+
+    def _load(self):
+        """ Returns ids of all questions grouped by (category_id, difficulty) and categories, runs in a thread """
+        groups = collections.defaultdict(lambda: array('i'))
+        categories = dict(Category.objects.values_list('name', 'id'))
+        # Ids come sorted, so they are appended to the groups
+        for question_id, category_id, difficulty in Question.objects.order_by('id').values_list(
+                'id', 'category_id', 'difficulty').iterator():
+            groups[(category_id, difficulty)].append(question_id)
+        return groups, categories
+
+    def _get_groups(self, category_id, difficulty):
+        return [ids for (group_category_id, group_difficulty), ids in self.groups.items()
+                if ids and category_id in (None, group_category_id) and difficulty in (None, group_difficulty)]
+
+    def _remember(self, ids):
+        for question_id in ids:
+            if question_id in self.recent_id_set:
+                continue
+            self.recent_ids.append(question_id)
+            self.recent_id_set.add(question_id)
+            if len(self.recent_ids) > self.recent_size:
+                self.recent_id_set.discard(self.recent_ids.popleft())
+
+    async def _run_loads(self):
+        # Games are served from the current ids until the new ones are ready, then they are swapped
+        try:
+            while self.load_requested:
+                self.load_requested = False
+                self.pending_changes = []
+                try:
+                    groups, categories = await database_sync_to_async(self._load)()
+                except Exception as e:
+                    print(f"Question pool not loaded: {e!r}")
+                    self.load_requested = True
+                    await asyncio.sleep(LOAD_RETRY_INTERVAL)
+                    continue
+                for change, args in self.pending_changes:
+                    change(groups, categories, *args)
+                self.groups, self.categories = groups, categories
+                self.loaded = True
+        finally:
+            self.is_loading = False
+            self.pending_changes = []
+
+# Public:
+
+    def load(self):
+        """
+        Starts loading ids from the database in the background and returns the task, which may be awaited.
+        A load in progress may have read the table before the request, it is repeated afterwards.
+        """
+        self.load_requested = True
+        if not self.is_loading:
+            self.is_loading = True
+            self.load_task = asyncio.ensure_future(self._run_loads())
+        return self.load_task
+
+    def add(self, question_id, category_id=None, difficulty=None):
+        self._change(self._add, question_id, category_id, difficulty)
+
+    def remove(self, question_id):
+        self._change(self._remove, question_id)
+
+    def change_category(self, category_id, name, deleted=False):
+        self._change(self._change_category, category_id, name, deleted)
+
+    def get_category_id(self, name):
+        """ Returns id of the category or None if it doesn't exist """
+        return self.categories.get(name)
+
+    def count_questions(self, category_id=None, difficulty=None):
+        return sum(len(ids) for ids in self._get_groups(category_id, difficulty))
+
+    def sample(self, amount, category_id=None, difficulty=None):
+        groups = self._get_groups(category_id, difficulty)
+        total = sum(len(ids) for ids in groups)
+        amount = min(amount, total)
+
+        def get_id(index):
+            # Index in all matching groups, groups are never concatenated
+            for ids in groups:
+                if index < len(ids):
+                    return ids[index]
+                index -= len(ids)
+
+        chosen = []
+        for _ in range(amount * 10):
+            if len(chosen) == amount:
+                return chosen
+            question_id = get_id(random.randrange(total))
+            if question_id not in self.recent_id_set and question_id not in chosen:
+                chosen.append(question_id)
+        # Almost all matching questions were served lately, they are served again
+        for index in random.sample(range(total), total):
+            if len(chosen) == amount:
+                break
+            question_id = get_id(index)
+            if question_id not in chosen:
+                chosen.append(question_id)
+        return chosen
+
+    async def get_random_questions(self, amount, category_id=None, difficulty=None):
+        ids = self.sample(amount, category_id, difficulty)
+        self._remember(ids)
+        return await self.get_questions(ids)
+
+    async def get_questions(self, ids):
+        questions = await database_sync_to_async(Question.objects.in_bulk)(ids)
+        # Questions deleted in the meantime are skipped
+        return [questions[question_id] for question_id in ids if question_id in questions]
+
+
+question_pool = QuestionPool(settings.RECENT_QUESTIONS_SIZE)
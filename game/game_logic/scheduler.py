@@ -0,0 +1,66 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+""" GameScheduler - single timer for phase deadlines of all games handled by a worker """
+
+
+class GameScheduler:
+    TICK = 0.05  # Deadlines due in the same tick are fired together
+
+    def __init__(self):
+        self.heap = []  # [[deadline, sequence, key, callback], ...]
+        self.entries = {}  # {key: entry}, at most one pending deadline per key ((game code, 'phase'), 'sweep', ...)
+        self._sequence = itertools.count()
+        self._task = None
+
+# Private:
+
+    async def _run(self):
+        while self.entries:
+            await asyncio.sleep(self.TICK)
+            batch = self._pop_due(time.monotonic())
+            if batch:
+                asyncio.ensure_future(self._fire(batch))
+        self.heap.clear()
+
+    def _pop_due(self, now):
+        batch = []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, _, key, callback = heapq.heappop(self.heap)
+            # Cancelled entries stay in the heap with no callback
+            if callback is not None:
+                del self.entries[key]
+                batch.append((key, callback))
+        return batch
+
+    async def _fire(self, batch):
+        results = await asyncio.gather(*[callback() for _, callback in batch], return_exceptions=True)
+        for (key, _), result in zip(batch, results):
+            if isinstance(result, Exception):
+                print(f"Scheduled call {key} failed: {result!r}")
+
+# Public:
+
+    def schedule(self, key, deadline, callback):
+        """ Calls callback() at deadline (time.monotonic() based), replacing the pending deadline of the key """
+        self.cancel(key)
+        entry = [deadline, next(self._sequence), key, callback]
+        self.entries[key] = entry
+        heapq.heappush(self.heap, entry)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def cancel(self, key):
+        entry = self.entries.pop(key, None)
+        if entry:
+            entry[3] = None
+
+    def is_scheduled(self, key):
+        return key in self.entries
+
+    def get_deadline(self, key):
+        entry = self.entries.get(key)
+        return entry[0] if entry else None
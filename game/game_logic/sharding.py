@@ -0,0 +1,71 @@
+import random
+
+import aioredis
+from django.conf import settings
+
+from game.game_logic.game_codes import get_code_space
+
+
+""" Sharding - splits games between several GameWorker processes by game code """
+
+GAME_MANAGER_CHANNEL = 'game-manager'
+SHARD_LOAD_KEY = 'game-manager-shard-load'
+
+
+def get_shard_count():
+    return max(1, settings.GAME_WORKER_SHARDS)
+
+
+def is_sharded():
+    return get_shard_count() > 1
+
+
+def get_shard_channel(shard):
+    # Single worker keeps listening on the plain 'game-manager' channel
+    if not is_sharded():
+        return GAME_MANAGER_CHANNEL
+    return f"{GAME_MANAGER_CHANNEL}-{shard}"
+
+
+def get_all_shard_channels():
+    return [get_shard_channel(shard) for shard in range(get_shard_count())]
+
+
+def get_shard_for_channel(channel):
+    if channel == GAME_MANAGER_CHANNEL:
+        return 0
+    return int(channel.rsplit('-', 1)[1])
+
+
+def get_shard_for_game_code(game_code):
+    # Invalid codes go to the first shard, it will reply that the game does not exist
+    index = get_code_space().get_index(game_code)
+    if index is None:
+        return 0
+    return index % get_shard_count()
+
+
+class ShardLoadBoard:
+    """ Number of active games of every shard, shared between processes through Redis """
+
+    def __init__(self):
+        self._redis = None
+
+    async def _get_redis(self):
+        if self._redis is None:
+            self._redis = await aioredis.create_redis_pool(settings.GAME_REDIS_URL)
+        return self._redis
+
+    async def report(self, shard, active_games):
+        redis = await self._get_redis()
+        await redis.hset(SHARD_LOAD_KEY, shard, active_games)
+
+    async def get_least_loaded_shard(self):
+        redis = await self._get_redis()
+        load = await redis.hgetall(SHARD_LOAD_KEY)
+        # Shards which haven't reported yet have no games. Ties are broken randomly.
+        return min(range(get_shard_count()),
+                   key=lambda shard: (int(load.get(str(shard).encode(), 0)), random.random()))
+
+
+shard_load_board = ShardLoadBoard()
@@ -0,0 +1,178 @@
+import os
+import socket
+
+import aioredis
+from django.conf import settings
+
+
+""" Game state stores - copy of running games' state, so another GameWorker can resume them """
+
+
+class MemoryGameStateStore:
+    """ Default store, state lives only in Game objects of the worker and is lost when it stops """
+
+    async def register_game(self, shard, game_code):
+        pass
+
+    async def save_game(self, game_code, state):
+        pass
+
+    async def delete_game(self, shard, game_code):
+        pass
+
+    async def save_player(self, game_code, channel_name, username):
+        pass
+
+    async def delete_player(self, game_code, channel_name):
+        pass
+
+    async def save_answers(self, game_code, answers):
+        pass
+
+    async def load_games(self, shard):
+        return []
+
+
+class RedisGameStateStore(MemoryGameStateStore):
+    """
+    Every game is kept in small Redis hashes:
+        game:<code>          - phase of the game and its deadline
+        game:<code>:players  - {channel_name: username}
+        game:<code>:scores   - {channel_name: total score}
+        game:<code>:answers  - {'question_id:channel_name': score}
+    Codes of games handled by a shard are kept in game-manager-games:<shard> set.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self._redis = None
+
+# Private:
+
+    async def _get_redis(self):
+        if self._redis is None:
+            self._redis = await aioredis.create_redis_pool(self.url)
+        return self._redis
+
+    @staticmethod
+    def _key(game_code, name=None):
+        return f"game:{game_code}:{name}" if name else f"game:{game_code}"
+
+# Public:
+
+    async def register_game(self, shard, game_code):
+        redis = await self._get_redis()
+        await redis.sadd(f"game-manager-games:{shard}", game_code)
+
+    async def save_game(self, game_code, state):
+        redis = await self._get_redis()
+        await redis.hmset_dict(self._key(game_code), {key: str(value) for key, value in state.items()})
+
+    async def delete_game(self, shard, game_code):
+        redis = await self._get_redis()
+        transaction = redis.multi_exec()
+        transaction.srem(f"game-manager-games:{shard}", game_code)
+        transaction.delete(self._key(game_code), self._key(game_code, 'players'), self._key(game_code, 'scores'),
+                           self._key(game_code, 'answers'))
+        await transaction.execute()
+
+    async def save_player(self, game_code, channel_name, username):
+        redis = await self._get_redis()
+        await redis.hset(self._key(game_code, 'players'), channel_name, username)
+
+    async def delete_player(self, game_code, channel_name):
+        redis = await self._get_redis()
+        transaction = redis.multi_exec()
+        transaction.hdel(self._key(game_code, 'players'), channel_name)
+        transaction.hdel(self._key(game_code, 'scores'), channel_name)
+        await transaction.execute()
+
+    async def save_answers(self, game_code, answers):
+        """ answers: [(channel_name, question_id, score), ...], saved atomically with total scores """
+        redis = await self._get_redis()
+        transaction = redis.multi_exec()
+        for channel_name, question_id, score in answers:
+            transaction.hset(self._key(game_code, 'answers'), f"{question_id}:{channel_name}", score)
+            transaction.hincrby(self._key(game_code, 'scores'), channel_name, score)
+        await transaction.execute()
+
+    async def load_games(self, shard):
+        """ Returns [{'game_code', 'state', 'players', 'answers'}, ...] of games stored by the shard """
+        redis = await self._get_redis()
+        games = []
+        for game_code in await redis.smembers(f"game-manager-games:{shard}", encoding='utf-8'):
+            answers = await redis.hgetall(self._key(game_code, 'answers'), encoding='utf-8')
+            games.append({
+                'game_code': game_code,
+                'state': await redis.hgetall(self._key(game_code), encoding='utf-8'),
+                'players': await redis.hgetall(self._key(game_code, 'players'), encoding='utf-8'),
+                'answers': [(*field.split(':', 1), int(score)) for field, score in answers.items()],
+            })
+        return games
+
+
+class RedisLeaseStore:
+    """
+    Leases of game-manager channels, kept in Redis with any state store: only one worker may consume a channel,
+    the channel layer would split its messages between all of them
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self._redis = None
+
+# Private:
+
+    async def _get_redis(self):
+        if self._redis is None:
+            self._redis = await aioredis.create_redis_pool(self.url)
+        return self._redis
+
+# Public:
+
+    async def acquire_lease(self, channel, owner, ttl):
+        redis = await self._get_redis()
+        return bool(await redis.set(f"game-manager-lease:{channel}", owner, expire=ttl,
+                                    exist=redis.SET_IF_NOT_EXIST))
+
+    async def refresh_lease(self, channel, owner, ttl):
+        redis = await self._get_redis()
+        if await redis.get(f"game-manager-lease:{channel}", encoding='utf-8') != owner:
+            return False
+        await redis.expire(f"game-manager-lease:{channel}", ttl)
+        return True
+
+    async def release_lease(self, channel, owner):
+        # Standby worker takes the channel over without waiting for the lease to expire
+        redis = await self._get_redis()
+        if await redis.get(f"game-manager-lease:{channel}", encoding='utf-8') == owner:
+            await redis.delete(f"game-manager-lease:{channel}")
+
+
+_state_store = None
+_lease_store = None
+
+
+def create_state_store():
+    if settings.GAME_STATE_STORE == 'redis':
+        return RedisGameStateStore(settings.GAME_REDIS_URL)
+    return MemoryGameStateStore()
+
+
+def get_state_store():
+    # Shared by the worker process, Redis connections are bound to the event loop which created them
+    global _state_store
+    if _state_store is None:
+        _state_store = create_state_store()
+    return _state_store
+
+
+def get_lease_store():
+    global _lease_store
+    if _lease_store is None:
+        _lease_store = RedisLeaseStore(settings.GAME_REDIS_URL)
+    return _lease_store
+
+
+def get_lease_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
@@ -0,0 +1,25 @@
+""" UsernameIndex - unique usernames of a game, duplicates get the next free suffix: 'Player', 'Player #1', ... """
+
+
+class UsernameIndex:
+    def __init__(self):
+        self.usernames = set()
+        self.next_suffixes = {}  # {requested username: first suffix which may be free}
+
+# Public:
+
+    def add(self, username):
+        """ Takes the username or its first free variant with a suffix and returns it """
+        if username in self.usernames:
+            suffix = self.next_suffixes.get(username, 1)
+            # Names with suffixes may be taken by players who typed them, they are skipped
+            while f"{username} #{suffix}" in self.usernames:
+                suffix += 1
+            self.next_suffixes[username] = suffix + 1
+            username = f"{username} #{suffix}"
+        self.usernames.add(username)
+        return username
+
+    def remove(self, username):
+        # Released suffixes are not reused, so joining stays O(1) however many players left
+        self.usernames.discard(username)
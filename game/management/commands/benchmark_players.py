@@ -0,0 +1,88 @@
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from game.game_logic.game import Game
+from game.game_logic.leaderboard import Leaderboard
+
+
+class DictPlayer:
+    """ Previous layout of players: attribute dict and a dict of scores """
+
+    def __init__(self, channel_name, username):
+        self.channel_name = channel_name
+        self.username = username
+        self.scores = {}
+
+    def set_answer(self, question_id, score):
+        if not self.scores.get(question_id, None):
+            self.scores[question_id] = score
+            return True
+        return False
+
+
+class DictRoom:
+    """ Previous layout of a game's players: everything keyed by channel names """
+
+    def __init__(self, questions_amount):
+        self.players = {}
+        self.leaderboard = Leaderboard(Game.MAX_SCORE * questions_amount)
+        self.sessions = {}
+
+    def add_player(self, channel_name, username, session):
+        player = self.players[channel_name] = DictPlayer(channel_name, username)
+        self.sessions[session] = channel_name
+        self.leaderboard.add(channel_name)
+        return player, channel_name
+
+
+class CompactRoom:
+    """ Structures of Game: players and their scores keyed by integer ids, one map of channel names to ids """
+
+    def __init__(self, questions_amount):
+        self.game = Game('000000', None, None, None, None, None)
+        self.game.QUESTIONS_AMOUNT = questions_amount
+        self.leaderboard = self.game.leaderboard = Leaderboard(Game.MAX_SCORE * questions_amount)
+
+    def add_player(self, channel_name, username, session):
+        player = self.game._create_player(channel_name, username)
+        player.session = session
+        self.game.sessions[session] = player.player_id
+        return player, player.player_id
+
+
+def measure(room_class, channel_names, usernames, sessions, questions_amount):
+    """ Returns bytes allocated by per-player structures of a game in which everyone answered every question """
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    room = room_class(questions_amount)
+    for player_id, (channel_name, username, session) in enumerate(zip(channel_names, usernames, sessions)):
+        player, key = room.add_player(channel_name, username, session)
+        for question_id in range(questions_amount):
+            player.set_answer(question_id, 500 + player_id % 500)
+            room.leaderboard.add_score(key, 500 + player_id % 500)
+    size = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return size
+
+
+class Command(BaseCommand):
+    help = ('Compares memory used by players of a large game - player records, scores, leaderboard and sessions - '
+            'in the dict based and the compact layout')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=10000, help='Number of players in the game')
+        parser.add_argument('--questions', type=int, default=Game.QUESTIONS_AMOUNT)
+
+    def handle(self, *args, **options):
+        amount, questions_amount = options['players'], options['questions']
+        # Channel names, usernames and session tokens come from the channel layer and clients, both layouts share them
+        channel_names = [f'specific.a1b2c3d4e5f6!g7h8i9j0k1l2{i}' for i in range(amount)]
+        usernames = [f'Player #{i}' for i in range(amount)]
+        sessions = [f'session-token-{i:08}' for i in range(amount)]
+        layouts = {'dict': DictRoom, 'compact': CompactRoom}
+        self.stdout.write(f"{amount} players, {questions_amount} questions")
+        self.stdout.write(f"{'layout':<10}{'total KiB':>12}{'bytes per player':>18}")
+        for name, room_class in layouts.items():
+            size = measure(room_class, channel_names, usernames, sessions, questions_amount)
+            self.stdout.write(f"{name:<10}{size / 1024:>12.1f}{size / amount:>18.1f}")
@@ -0,0 +1,35 @@
+import json
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from game.game_logic import frames
+
+
+class Command(BaseCommand):
+    help = 'Compares size and encoding time of JSON and msgpack client frames'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=500, help='Number of players in the scores payload')
+        parser.add_argument('--repeat', type=int, default=10000, help='Number of encodings measured per payload')
+
+    def handle(self, *args, **options):
+        payloads = {
+            'question': frames.question(1, 10, 'Which planet is known as the Red Planet?',
+                                        ['Venus', 'Mars', 'Jupiter', 'Saturn']),
+            'scores': frames.quiz_end([{'user': f'Player #{i}', 'score': 1000 - i}
+                                       for i in range(options['players'])]),
+        }
+        formats = {
+            'json': (frames.encode, json.loads),
+            'msgpack': (frames.encode_binary, frames.decode_binary),
+        }
+        repeat = options['repeat']
+        self.stdout.write(f"{'payload':<10}{'format':<10}{'bytes':>10}{'encode us':>12}{'decode us':>12}")
+        for payload_name, payload in payloads.items():
+            for format_name, (encode, decode) in formats.items():
+                data = encode(payload)
+                encode_time = timeit.timeit(lambda: encode(payload), number=repeat) / repeat * 1e6
+                decode_time = timeit.timeit(lambda: decode(data), number=repeat) / repeat * 1e6
+                self.stdout.write(f"{payload_name:<10}{format_name:<10}{len(data):>10}"
+                                  f"{encode_time:>12.2f}{decode_time:>12.2f}")
@@ -0,0 +1,35 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game.models import Question
+from game.question_bank import get_format, write_rows
+
+
+class Command(BaseCommand):
+    help = 'Exports all questions to a CSV or JSONL file, streaming them from the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file, '-' writes to standard output")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Taken from the file extension by default')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Questions fetched from the database at once')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            file_format = get_format(path, options['format'] or ('jsonl' if path == '-' else None))
+        except ValueError as e:
+            raise CommandError(e)
+        # iterator() doesn't cache the queryset, so memory doesn't grow with the number of questions
+        questions = Question.objects.select_related('category').order_by('id').iterator(
+            chunk_size=options['chunk_size'])
+        start = time.monotonic()
+        if path == '-':
+            count = write_rows(sys.stdout, file_format, questions)
+        else:
+            with open(path, 'w', newline='', encoding='utf-8') as file:
+                count = write_rows(file, file_format, questions)
+        elapsed = time.monotonic() - start
+        # Standard output may be the exported file
+        self.stderr.write(f"{count} questions exported in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} rows/s)")
@@ -0,0 +1,118 @@
+import json
+import os
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from game.game_logic.sharding import get_all_shard_channels
+from game.models import Category, Question
+from game.question_bank import InvalidQuestion, get_format, read_rows, validate_row
+
+REPORT_INTERVAL = 5  # Seconds between progress reports
+
+
+class Command(BaseCommand):
+    help = ('Imports questions from a CSV or JSONL file in constant memory. Invalid rows and questions with content '
+            'already in the database are skipped. An interrupted import can be continued with --resume.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV with columns content, answer0-3, correct_answer or JSONL with '
+                                         'content, answers and correct_answer. Optional category and difficulty '
+                                         '(easy, medium or hard) are read from both formats.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Taken from the file extension by default')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Questions inserted in one transaction')
+        parser.add_argument('--resume', action='store_true',
+                            help='Skip rows saved before the last interrupted import of the file')
+
+    def _read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as file:
+                return json.load(file)['row']
+        except FileNotFoundError:
+            return 0
+
+    def _write_checkpoint(self, row):
+        # Written after every committed batch, replaced atomically so a crash never leaves a broken checkpoint
+        with open(self.checkpoint_path + '.tmp', 'w') as file:
+            json.dump({'row': row}, file)
+        os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+
+    def _get_category_id(self, name):
+        # Few categories, all of them stay in memory during the import
+        if name is None:
+            return None
+        if name not in self.categories:
+            self.categories[name] = Category.objects.get_or_create(name=name)[0].id
+        return self.categories[name]
+
+    def _save_batch(self, batch, last_row):
+        # Duplicates in the file are found by the same query - earlier batches are already in the database
+        questions = {}
+        for question in batch:
+            questions.setdefault(question.content, question)
+        with transaction.atomic():
+            existing = set(Question.objects.filter(content__in=questions.keys()).values_list('content', flat=True))
+            new_questions = [question for content, question in questions.items() if content not in existing]
+            Question.objects.bulk_create(new_questions)
+        self._write_checkpoint(last_row)
+        self.imported += len(new_questions)
+        self.duplicates += len(batch) - len(new_questions)
+
+    def _report(self, rows, start):
+        elapsed = time.monotonic() - start
+        self.stdout.write(f"{rows} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/s): "
+                          f"{self.imported} imported, {self.duplicates} duplicates, {self.invalid} invalid")
+
+    def _notify_game_managers(self):
+        # bulk_create sends no post_save signals, workers reload their question pools instead
+        channel_layer = get_channel_layer()
+        for channel in get_all_shard_channels():
+            async_to_sync(channel_layer.send)(channel, {"type": "questions_imported"})
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            file_format = get_format(path, options['format'])
+        except ValueError as e:
+            raise CommandError(e)
+        self.checkpoint_path = path + '.checkpoint'
+        self.imported = self.duplicates = self.invalid = 0
+        self.categories = {}  # {name: category_id}
+        skipped_rows = self._read_checkpoint() if options['resume'] else 0
+        if skipped_rows:
+            self.stdout.write(f"Resuming after row {skipped_rows}")
+
+        batch, rows, row_number = [], 0, skipped_rows
+        start = last_report = time.monotonic()
+        try:
+            with open(path, newline='', encoding='utf-8') as file:
+                for row_number, row in read_rows(file, file_format):
+                    if row_number <= skipped_rows:
+                        continue
+                    rows += 1
+                    try:
+                        if row is None:
+                            raise InvalidQuestion("row is not a JSON object")
+                        question, category = validate_row(row)
+                        question.category_id = self._get_category_id(category)
+                        batch.append(question)
+                    except InvalidQuestion as e:
+                        self.invalid += 1
+                        self.stderr.write(f"Row {row_number}: {e}")
+                    if len(batch) >= options['batch_size']:
+                        self._save_batch(batch, row_number)
+                        batch = []
+                        if time.monotonic() - last_report >= REPORT_INTERVAL:
+                            self._report(rows, start)
+                            last_report = time.monotonic()
+                if batch:
+                    self._save_batch(batch, row_number)
+        finally:
+            if self.imported:
+                self._notify_game_managers()
+        self._report(rows, start)
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
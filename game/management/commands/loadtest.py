@@ -0,0 +1,187 @@
+import asyncio
+import contextlib
+import json
+import os
+import random
+import time
+
+from channels.layers import channel_layers, get_channel_layer
+from channels.routing import ChannelNameRouter
+from channels.testing import WebsocketCommunicator
+from channels.worker import Worker
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from game.consumers import ChatConsumer
+from game.game_logic.game import Game
+from game.game_logic.game_manager import GameWorker
+from game.game_logic.question_pool import question_pool
+from game.game_logic.scheduler import GameScheduler
+from game.game_logic.sharding import get_all_shard_channels
+from game.models import Question
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class SimulatedPlayer:
+    """ WebSocket client playing a whole game through ChatConsumer """
+
+    def __init__(self, harness, username):
+        self.harness = harness
+        self.username = username
+        self.communicator = WebsocketCommunicator(ChatConsumer, '/ws/game/')
+        self.game_code = None
+        self.game_created = asyncio.Event()
+        self.game_ended = asyncio.Event()
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise CommandError('Simulated player could not connect')
+        asyncio.ensure_future(self._receive_frames())
+
+    async def send(self, **request):
+        await self.communicator.send_to(text_data=json.dumps(request))
+
+    async def _answer(self, question_id, answers_amount):
+        await asyncio.sleep(self.harness.get_answer_delay())
+        await self.send(type='answer', question_id=question_id, answer=random.randrange(answers_amount))
+
+    async def _receive_frames(self):
+        while not self.game_ended.is_set():
+            output = await self.communicator.receive_output(timeout=self.harness.timeout)
+            if output['type'] != 'websocket.send':
+                continue
+            frame = json.loads(output['text'])
+            self.harness.on_frame(self, frame)
+            if frame['type'] == 'game_created':
+                self.game_code = frame['code']
+                self.game_created.set()
+            elif frame['type'] == 'question':
+                asyncio.ensure_future(self._answer(frame['question_id'], len(frame['answers'])))
+            elif frame['type'] == 'quiz_end':
+                self.game_ended.set()
+
+
+class Command(BaseCommand):
+    help = ('Plays many simulated games against GameWorker on the in-memory channel layer and reports throughput, '
+            'delivery latency and worker CPU time')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=10, help='Number of games played at the same time')
+        parser.add_argument('--players', type=int, default=100, help='Number of players in every game')
+        parser.add_argument('--question-length', type=float, default=Game.QUESTION_LENGTH)
+        parser.add_argument('--break-length', type=float, default=Game.BREAK_LENGTH)
+        parser.add_argument('--answer-median', type=float, default=3.0,
+                            help='Median time of answers, answer times are log-normally distributed')
+        parser.add_argument('--answer-sigma', type=float, default=0.5)
+        parser.add_argument('--timeout', type=float, default=120.0)
+
+    def get_answer_delay(self):
+        delay = random.lognormvariate(0, self.answer_sigma) * self.answer_median
+        return min(delay, self.question_length * 0.95)
+
+    def on_frame(self, player, frame):
+        now = time.perf_counter()
+        self.frames_received += 1
+        if frame['type'] in ('question', 'question_end'):
+            sent_at = self.sent_at.get((player.game_code, frame['type'], frame['question_id']))
+            if sent_at is not None:
+                self.latencies[frame['type']].append(now - sent_at)
+
+    def _instrument(self):
+        """ Records when frames are sent by games and how much CPU time the worker uses """
+        harness = self
+        start_question, send_question_results = Game._start_question, Game._send_question_results
+        dispatch, fire = GameWorker.dispatch, GameScheduler._fire
+
+        async def timed_start_question(game, question_id, deadline):
+            harness.sent_at[(game.game_code, 'question', question_id)] = time.perf_counter()
+            await start_question(game, question_id, deadline)
+
+        async def timed_send_question_results(game, question_id):
+            harness.sent_at[(game.game_code, 'question_end', question_id)] = time.perf_counter()
+            await send_question_results(game, question_id)
+
+        # Clients run in the same thread, so CPU time is counted only inside worker's handlers. Sends to
+        # the in-memory layer don't switch to other tasks, so the measure is close to the worker's own CPU time.
+        async def timed_dispatch(worker, message):
+            start = time.thread_time()
+            await dispatch(worker, message)
+            harness.worker_cpu_time += time.thread_time() - start
+
+        async def timed_fire(scheduler, batch):
+            start = time.thread_time()
+            await fire(scheduler, batch)
+            harness.worker_cpu_time += time.thread_time() - start
+
+        Game._start_question, Game._send_question_results = timed_start_question, timed_send_question_results
+        GameWorker.dispatch, GameScheduler._fire = timed_dispatch, timed_fire
+        Game.QUESTION_LENGTH, Game.BREAK_LENGTH = self.question_length, self.break_length
+
+    async def _play_game(self, game_index):
+        host = SimulatedPlayer(self, f'Host {game_index}')
+        await host.connect()
+        await host.send(type='new_game', user=host.username)
+        await asyncio.wait_for(host.game_created.wait(), self.timeout)
+
+        players = [host]
+        for player_index in range(1, self.players):
+            player = SimulatedPlayer(self, f'Player {game_index}.{player_index}')
+            player.game_code = host.game_code
+            await player.connect()
+            await player.send(type='join', user=player.username, game_code=host.game_code)
+            players.append(player)
+        # Joined players are added to the game's group with the next users update
+        await asyncio.sleep(Game.USERS_UPDATE_DELAY * 2)
+
+        await host.send(type='start')
+        await asyncio.wait_for(asyncio.gather(*[p.game_ended.wait() for p in players]), self.timeout)
+        for player in players:
+            await player.communicator.disconnect()
+
+    async def _run(self):
+        worker = Worker(application=ChannelNameRouter({channel: GameWorker for channel in get_all_shard_channels()}),
+                        channels=get_all_shard_channels(), channel_layer=get_channel_layer())
+        worker_task = asyncio.ensure_future(worker.handle())
+        await question_pool.load()
+        start = time.perf_counter()
+        await asyncio.gather(*[self._play_game(i) for i in range(self.games)])
+        duration = time.perf_counter() - start
+        worker_task.cancel()
+        return duration
+
+    def handle(self, *args, **options):
+        if Question.objects.count() < Game.QUESTIONS_AMOUNT:
+            raise CommandError(f'At least {Game.QUESTIONS_AMOUNT} questions are needed in the database')
+        self.games, self.players = options['games'], options['players']
+        self.question_length, self.break_length = options['question_length'], options['break_length']
+        self.answer_median, self.answer_sigma = options['answer_median'], options['answer_sigma']
+        self.timeout = options['timeout']
+        self.frames_received = 0
+        self.sent_at = {}
+        self.latencies = {'question': [], 'question_end': []}
+        self.worker_cpu_time = 0.0
+
+        self._instrument()
+        in_memory_layer = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer',
+                                       'CONFIG': {'capacity': 100000}}}
+        with override_settings(CHANNEL_LAYERS=in_memory_layer, GAME_WORKER_SHARDS=1, GAME_STATE_STORE='memory'):
+            channel_layers.backends.clear()
+            # Workers print every created and removed game
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                duration = asyncio.run(self._run())
+            channel_layers.backends.clear()
+
+        self.stdout.write(f"Games: {self.games}, players per game: {self.players}, duration: {duration:.1f}s")
+        self.stdout.write(f"Frames delivered: {self.frames_received} ({self.frames_received / duration:.0f}/s)")
+        for frame_type, latencies in self.latencies.items():
+            self.stdout.write(f"{frame_type} delivery latency: p50 {percentile(latencies, 0.5) * 1000:.1f}ms, "
+                              f"p99 {percentile(latencies, 0.99) * 1000:.1f}ms")
+        self.stdout.write(f"Worker CPU time: {self.worker_cpu_time:.2f}s "
+                          f"({self.worker_cpu_time / self.games * 1000:.1f}ms per game)")
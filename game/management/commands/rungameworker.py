@@ -0,0 +1,107 @@
+import asyncio
+import signal
+
+from channels.management.commands.runworker import Command as RunWorkerCommand
+from channels.worker import Worker
+from django.conf import settings
+from django.core.management.base import CommandError
+
+from game.game_logic.history import history_writer
+from game.game_logic.question_pool import question_pool
+from game.game_logic.state_store import get_lease_owner, get_lease_store
+
+
+class GameWorkerServer(Worker):
+    """
+    Worker of game-manager channels. While another worker holds the lease of a channel it runs as a standby:
+    it handles only messages handed off to its own hand-off channel by the draining worker. On SIGTERM it drains:
+    running games are finished and the process exits when the last one ends. A worker which can't refresh its
+    lease exits too, so two workers never consume one channel.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.listeners = []
+        self.drained_channels = set()
+        self.lost_lease_channel = None
+        self.main_task = None
+
+    def _get_instance_queue(self, channel):
+        # Messages of the channel and its hand-off channel go to the same GameWorker
+        return self.get_or_create_application_instance(channel, {"type": "channel", "channel": channel})
+
+    async def _acquire_lease(self, store, channel):
+        owner = get_lease_owner()
+        handoff_channel = None
+        while not await store.acquire_lease(channel, owner, settings.GAME_WORKER_LEASE_TTL):
+            print(f"Channel {channel} is handled by another worker, waiting...")
+            if handoff_channel is None:
+                # Only this process listens on the hand-off channel
+                handoff_channel = await self.channel_layer.new_channel(f"{channel}.handoff")
+                self.listeners.append(asyncio.ensure_future(self.listener(handoff_channel, channel)))
+            # Lets the worker holding the lease hand off new games when it is draining
+            await self.channel_layer.send(channel, {"type": "worker_standby", "handoff_channel": handoff_channel})
+            await asyncio.sleep(settings.GAME_WORKER_LEASE_TTL / 3)
+
+    async def listener(self, channel, scope_channel=None):
+        scope_channel = scope_channel or channel
+        while True:
+            message = await self.channel_layer.receive(channel)
+            if not message.get("type", None):
+                raise ValueError("Worker received message with no type.")
+            await self._get_instance_queue(scope_channel).put(message)
+
+    async def handle(self):
+        # Standby loads questions while it waits for the lease, so it creates games as soon as it takes over
+        question_pool.load()
+        store = get_lease_store()
+        for channel in self.channels:
+            await self._acquire_lease(store, channel)
+            self.listeners.append(asyncio.ensure_future(self.listener(channel)))
+            # Wakes the worker up, so it resumes stored games without waiting for players' messages
+            self._get_instance_queue(channel).put_nowait({"type": "resume_games"})
+        await asyncio.wait(self.listeners)
+        [listener.result() for listener in self.listeners]
+
+    async def application_send(self, scope, message):
+        if message['type'] == 'worker.lease_lost':
+            # Another worker may consume the channel already, games continue there from the state store
+            self.lost_lease_channel = scope['channel']
+            self.main_task.cancel()
+        if message['type'] == 'worker.drained':
+            self.drained_channels.add(scope['channel'])
+            if self.drained_channels == set(self.channels):
+                self.main_task.cancel()
+
+    def drain(self):
+        print("Draining workers...")
+        for channel in self.channels:
+            self._get_instance_queue(channel).put_nowait({"type": "drain"})
+
+    def run(self):
+        event_loop = asyncio.get_event_loop()
+        asyncio.ensure_future(self.application_checker())
+        self.main_task = asyncio.ensure_future(self.handle())
+        event_loop.add_signal_handler(signal.SIGTERM, self.drain)
+        try:
+            event_loop.run_until_complete(self.main_task)
+        except asyncio.CancelledError:
+            if self.lost_lease_channel:
+                raise CommandError(f"Lease of {self.lost_lease_channel} lost, exiting")
+            print("Workers drained, exiting")
+        except KeyboardInterrupt:
+            pass
+
+
+class Command(RunWorkerCommand):
+    help = ('Runs game-manager workers. The worker waits as a standby until the channel is free, with Redis state '
+            'store it resumes games of the previous worker. SIGTERM drains the worker: running games are '
+            'finished and new ones are handed off to the standby worker.')
+    worker_class = GameWorkerServer
+
+    def handle(self, *args, **options):
+        try:
+            super().handle(*args, **options)
+        finally:
+            # Finished games still waiting in the queue
+            history_writer.flush()
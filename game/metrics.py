@@ -0,0 +1,181 @@
+import time
+
+
+""" Metrics - counters, gauges and histograms exposed in Prometheus text format """
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}  # {labels_key: value}
+
+    def get_samples(self):
+        return [(self.name, dict(labels), value) for labels, value in self.values.items()]
+
+    def collect(self):
+        return {'name': self.name, 'type': self.type, 'help': self.documentation, 'samples': self.get_samples()}
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _labels_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(_labels_key(labels), 0)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        self.values[_labels_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _labels_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = buckets  # Values are [count per bucket..., count of +Inf bucket, sum]
+
+    def observe(self, value, **labels):
+        key = _labels_key(labels)
+        counts = self.values.get(key)
+        if counts is None:
+            counts = self.values[key] = [0] * (len(self.buckets) + 2)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        else:
+            counts[len(self.buckets)] += 1
+        counts[-1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def get_samples(self):
+        samples = []
+        for labels, counts in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', dict(labels, le=str(bound)), cumulative))
+            samples.append((self.name + '_count', dict(labels), cumulative))
+            samples.append((self.name + '_sum', dict(labels), counts[-1]))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, documentation):
+        return self._register(Counter(name, documentation))
+
+    def gauge(self, name, documentation):
+        return self._register(Gauge(name, documentation))
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, buckets))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self, **extra_labels):
+        """ Returns metric families as plain data, so they can be sent over the channel layer """
+        families = [metric.collect() for metric in self.metrics]
+        for family in families:
+            family['samples'] = [(name, dict(labels, **extra_labels), value)
+                                 for name, labels, value in family['samples']]
+        return families
+
+
+def render(families):
+    """ Renders metric families (possibly collected by several processes) in Prometheus text format """
+    merged = {}
+    for family in families:
+        if family['name'] in merged:
+            merged[family['name']]['samples'].extend(family['samples'])
+        else:
+            merged[family['name']] = dict(family, samples=list(family['samples']))
+    lines = []
+    for family in merged.values():
+        lines.append(f"# HELP {family['name']} {family['help']}")
+        lines.append(f"# TYPE {family['name']} {family['type']}")
+        for name, labels, value in family['samples']:
+            label_text = ','.join(f'{key}="{label_value}"' for key, label_value in sorted(labels.items()))
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# Server processes (ChatConsumer)
+open_connections = registry.gauge('game_consumer_open_connections', 'Open WebSocket connections')
+frames_received = registry.counter('game_consumer_frames_received_total', 'Frames received from clients')
+frames_sent = registry.counter('game_consumer_frames_sent_total', 'Frames sent to clients')
+
+# Game workers
+active_games = registry.gauge('game_worker_active_games', 'Games handled by the worker')
+active_players = registry.gauge('game_worker_active_players', 'Players in games handled by the worker')
+active_spectators = registry.gauge('game_worker_active_spectators', 'Spectators of games handled by the worker')
+worker_messages = registry.counter('game_worker_messages_total', 'Messages handled by the worker')
+handler_latency = registry.histogram('game_worker_handler_seconds', 'Time spent in GameWorker handlers')
+queue_lag = registry.histogram('game_worker_queue_lag_seconds',
+                               'Time between sending a message to the worker and handling it')
+channel_layer_latency = registry.histogram('game_worker_channel_layer_seconds', 'Time of channel layer calls')
+results_fan_out = registry.histogram('game_question_results_fan_out_seconds',
+                                     'Time of sending question results to all players')
+undelivered_results = registry.counter('game_question_results_undelivered_total',
+                                       'Question results not delivered to players')
+
+
+class TimedChannelLayer:
+    """ Channel layer wrapper measuring time of sends """
+
+    def __init__(self, channel_layer):
+        self.channel_layer = channel_layer
+
+    def __getattr__(self, name):
+        return getattr(self.channel_layer, name)
+
+    async def send(self, channel, message):
+        with channel_layer_latency.time(method='send'):
+            await self.channel_layer.send(channel, message)
+
+    async def group_send(self, group, message):
+        with channel_layer_latency.time(method='group_send'):
+            await self.channel_layer.group_send(group, message)
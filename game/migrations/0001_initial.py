@@ -0,0 +1,27 @@
+# Generated by Django 3.1.1 on 2026-10-18 21:06
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Question',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content', models.CharField(max_length=100)),
+                ('answer0', models.CharField(max_length=100)),
+                ('answer1', models.CharField(max_length=100)),
+                ('answer2', models.CharField(max_length=100)),
+                ('answer3', models.CharField(max_length=100)),
+                ('correct_answer', models.IntegerField(validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(3)])),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.1.1 on 2026-10-18 21:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayedGame',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('code', models.CharField(max_length=10)),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(db_index=True)),
+                ('players_amount', models.IntegerField()),
+                ('questions_amount', models.IntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PlayedAnswer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question_index', models.IntegerField()),
+                ('username', models.CharField(max_length=100)),
+                ('answer', models.IntegerField(null=True)),
+                ('answer_time', models.FloatField(null=True)),
+                ('score', models.IntegerField()),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answers', to='game.playedgame')),
+                ('question', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='played_answers', to='game.question')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.1 on 2026-10-18 21:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0002_playedgame_playedanswer'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='question',
+            name='content',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+    ]
@@ -1,3 +1,5 @@
+import uuid
+
 from django.contrib.postgres.fields import ArrayField
 from django.contrib.postgres.forms import SimpleArrayField
 from django.db import models
@@ -9,8 +11,27 @@ ANSWER_LENGTH = 50
 AMOUNT_OF_ANSWERS = 4
 
 
+class Category(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+
+    class Meta:
+        verbose_name_plural = 'categories'
+
+    def __str__(self):
+        return self.name
+
+
+class Difficulty(models.IntegerChoices):
+    EASY = 1
+    MEDIUM = 2
+    HARD = 3
+
+
 class Question(models.Model):
-    content = models.CharField(max_length=100)
+    # Indexed for duplicate checks of bulk imports
+    content = models.CharField(max_length=100, db_index=True)
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='questions')
+    difficulty = models.IntegerField(choices=Difficulty.choices, default=Difficulty.MEDIUM, db_index=True)
     # answers = ListCharField(base_field=models.CharField(max_length=ANSWER_LENGTH), size=AMOUNT_OF_ANSWERS,
     #                         max_length=AMOUNT_OF_ANSWERS*ANSWER_LENGTH + AMOUNT_OF_ANSWERS - 1, delimiter='|')
     answer0 = models.CharField(max_length=100)
@@ -19,6 +40,10 @@ class Question(models.Model):
     answer3 = models.CharField(max_length=100)
     correct_answer = models.IntegerField(validators=[MinValueValidator(0), MaxValueValidator(3)])
 
+    class Meta:
+        # Game workers load ids of questions with their category and difficulty, see QuestionPool
+        indexes = [models.Index(fields=['category', 'difficulty'])]
+
     @property
     def answers(self):
         return [self.answer0, self.answer1, self.answer2, self.answer3]
@@ -31,3 +56,27 @@ class Question(models.Model):
 
     def __str__(self):
         return self.content
+
+
+class PlayedGame(models.Model):
+    # Primary keys are generated by game workers, so answers can be bulk created together with their games
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    code = models.CharField(max_length=10)
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(db_index=True)
+    players_amount = models.IntegerField()
+    questions_amount = models.IntegerField()
+
+    def __str__(self):
+        return f"{self.code} ({self.finished_at})"
+
+
+class PlayedAnswer(models.Model):
+    game = models.ForeignKey(PlayedGame, on_delete=models.CASCADE, related_name='answers')
+    question = models.ForeignKey(Question, on_delete=models.SET_NULL, null=True, related_name='played_answers')
+    question_index = models.IntegerField()
+    username = models.CharField(max_length=100)
+    # Answers restored after a game was resumed by another worker have only their score
+    answer = models.IntegerField(null=True)
+    answer_time = models.FloatField(null=True)
+    score = models.IntegerField()
@@ -0,0 +1,123 @@
+import csv
+import json
+
+from game.models import AMOUNT_OF_ANSWERS, Category, Difficulty, Question
+
+
+""" Question bank - streaming readers and writers of question files in CSV and JSONL formats """
+
+FORMATS = ('csv', 'jsonl')
+ANSWER_FIELDS = [f'answer{i}' for i in range(AMOUNT_OF_ANSWERS)]
+CSV_FIELDS = ['content'] + ANSWER_FIELDS + ['correct_answer', 'category', 'difficulty']
+
+
+class InvalidQuestion(Exception):
+    pass
+
+
+def get_format(path, file_format=None):
+    file_format = file_format or path.rsplit('.', 1)[-1].lower()
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown format of {path}, use one of: {', '.join(FORMATS)}")
+    return file_format
+
+
+def _get_max_length(field, model=Question):
+    return model._meta.get_field(field).max_length
+
+
+def _clean_text(field, value):
+    if not isinstance(value, str) or not value.strip():
+        raise InvalidQuestion(f"{field} is empty")
+    value = value.strip()
+    if len(value) > _get_max_length(field):
+        raise InvalidQuestion(f"{field} is longer than {_get_max_length(field)} characters")
+    return value
+
+
+def _clean_difficulty(value):
+    # Optional, questions without difficulty are medium
+    if value is None or value == '':
+        return Difficulty.MEDIUM
+    if not isinstance(value, str) or value.strip().upper() not in Difficulty.names:
+        raise InvalidQuestion(f"difficulty is not one of: {', '.join(name.lower() for name in Difficulty.names)}")
+    return Difficulty[value.strip().upper()]
+
+
+def _clean_correct_answer(value):
+    # JSONL true or 2.7 is a broken answer key, not answer 1 or 2
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise InvalidQuestion("correct_answer is not a whole number")
+    try:
+        correct_answer = int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise InvalidQuestion("correct_answer is not a number")
+    if not 0 <= correct_answer < AMOUNT_OF_ANSWERS:
+        raise InvalidQuestion(f"correct_answer is not in range 0-{AMOUNT_OF_ANSWERS - 1}")
+    return correct_answer
+
+
+def _clean_category(value):
+    if value is None or value == '':
+        return None
+    if not isinstance(value, str) or len(value.strip()) > _get_max_length('name', Category):
+        raise InvalidQuestion(f"category is longer than {_get_max_length('name', Category)} characters")
+    return value.strip() or None
+
+
+def validate_row(row):
+    """ Returns an unsaved Question built from a row of a file and name of its category, raises InvalidQuestion """
+    # JSONL rows may keep answers in a list, CSV rows have a column per answer
+    answers = row.get('answers', None)
+    if answers is None:
+        answers = [row.get(field, None) for field in ANSWER_FIELDS]
+    if not isinstance(answers, list) or len(answers) != AMOUNT_OF_ANSWERS:
+        raise InvalidQuestion(f"question needs {AMOUNT_OF_ANSWERS} answers")
+    question = Question(content=_clean_text('content', row.get('content', None)),
+                        correct_answer=_clean_correct_answer(row.get('correct_answer', None)),
+                        difficulty=_clean_difficulty(row.get('difficulty', None)))
+    for field, answer in zip(ANSWER_FIELDS, answers):
+        setattr(question, field, _clean_text(field, answer))
+    return question, _clean_category(row.get('category', None))
+
+
+def read_rows(file, file_format):
+    """ Yields (row number, row) one at a time, rows that can't be parsed are yielded as None """
+    if file_format == 'csv':
+        # Row numbers count records, not lines - quoted values may span several lines
+        for number, row in enumerate(csv.DictReader(file), 1):
+            yield number, row
+        return
+    for number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+def write_rows(file, file_format, questions):
+    """ Writes questions one at a time and returns their number """
+    count = 0
+    if file_format == 'csv':
+        writer = csv.writer(file)
+        writer.writerow(CSV_FIELDS)
+        for question in questions:
+            writer.writerow([question.content] + question.answers +
+                            [question.correct_answer, question.category.name if question.category else '',
+                             Difficulty(question.difficulty).name.lower()])
+            count += 1
+        return count
+    for question in questions:
+        row = {
+            'content': question.content,
+            'answers': question.answers,
+            'correct_answer': question.correct_answer,
+            'category': question.category.name if question.category else None,
+            'difficulty': Difficulty(question.difficulty).name.lower(),
+        }
+        file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        count += 1
+    return count
@@ -0,0 +1,25 @@
+import time
+
+from game.metrics import registry
+
+
+""" Per connection limits of client requests """
+
+limited_requests = registry.counter('game_consumer_limited_requests_total', 'Requests dropped by rate limits')
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate  # Tokens added per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def consume(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
@@ -0,0 +1,110 @@
+from django.conf import settings
+
+from game.metrics import registry
+from game.models import AMOUNT_OF_ANSWERS, Category, Difficulty
+
+
+""" Schemas of client requests, checked by ChatConsumer before anything is sent to the channel layer """
+
+USERNAME_MAX_LENGTH = 30
+SESSION_MAX_LENGTH = 64
+
+rejected_requests = registry.counter('game_consumer_rejected_requests_total', 'Invalid requests rejected by consumers')
+
+
+class InvalidRequest(Exception):
+    def __init__(self, msg):
+        super().__init__(msg)
+        self.msg = msg
+
+
+def username(value):
+    if not isinstance(value, str) or not value.strip():
+        raise InvalidRequest("Some data is missing")
+    if len(value) > USERNAME_MAX_LENGTH:
+        raise InvalidRequest(f"Username can't be longer than {USERNAME_MAX_LENGTH} characters")
+    return value
+
+
+def game_code(value):
+    # Codes are strings, but clients may send numeric codes as numbers, losing leading zeros
+    if isinstance(value, int) and not isinstance(value, bool):
+        value = str(value).rjust(settings.GAME_CODE_LENGTH, settings.GAME_CODE_ALPHABET[0])
+    if not isinstance(value, str) or not value:
+        raise InvalidRequest("Some data is missing")
+    # Length of codes is configurable, longer values are never codes of games
+    if len(value) > settings.GAME_CODE_LENGTH:
+        raise InvalidRequest(f"Game with code {value[:settings.GAME_CODE_LENGTH]}... does not exist")
+    return value
+
+
+def session(value):
+    if not isinstance(value, str) or not value or len(value) > SESSION_MAX_LENGTH:
+        raise InvalidRequest("Session expired")
+    return value
+
+
+def category(value):
+    # Optional, games without a category draw questions from all of them
+    if value is None:
+        return None
+    if not isinstance(value, str) or not value or len(value) > Category._meta.get_field('name').max_length:
+        raise InvalidRequest("Unknown category")
+    return value
+
+
+def difficulty(value):
+    if value is None:
+        return None
+    if not isinstance(value, str) or value.upper() not in Difficulty.names:
+        raise InvalidRequest(f"Difficulty has to be one of: {', '.join(name.lower() for name in Difficulty.names)}")
+    return Difficulty[value.upper()].value
+
+
+def integer(msg, min_value, max_value):
+    def convert(value):
+        if isinstance(value, bool):
+            raise InvalidRequest(msg)
+        # 1.9 is not question 1
+        if isinstance(value, float) and not value.is_integer():
+            raise InvalidRequest(msg)
+        try:
+            value = int(value)
+        except (TypeError, ValueError, OverflowError):
+            raise InvalidRequest(msg)
+        if not min_value <= value <= max_value:
+            raise InvalidRequest(msg)
+        return value
+    return convert
+
+
+REQUEST_SCHEMAS = {
+    'new_game': {'user': username, 'category': category, 'difficulty': difficulty},
+    'join': {'user': username, 'game_code': game_code},
+    'resume': {'game_code': game_code, 'session': session},
+    'watch': {'game_code': game_code},
+    'start': {},
+    'answer': {
+        'question_id': integer("Question id is not a number", 0, 2**31 - 1),
+        'answer': integer("Wrong answer format", 0, AMOUNT_OF_ANSWERS - 1),
+    },
+    'users': {},
+    'leave': {},
+}
+
+
+def validate(request):
+    """ Returns (request_type, {field: value}) of a decoded request or raises InvalidRequest """
+    request_type = request.get('type') if isinstance(request, dict) else None
+    try:
+        # Lists and dicts can't be looked up in the schemas
+        if not isinstance(request_type, str):
+            raise InvalidRequest("Malformed request")
+        schema = REQUEST_SCHEMAS.get(request_type)
+        if schema is None:
+            raise InvalidRequest("Unknown request type")
+        return request_type, {field: convert(request.get(field)) for field, convert in schema.items()}
+    except InvalidRequest:
+        known = isinstance(request_type, str) and request_type in REQUEST_SCHEMAS
+        rejected_requests.inc(type=request_type if known else 'unknown')
+        raise
@@ -0,0 +1,63 @@
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from game.game_logic.sharding import get_all_shard_channels
+from game.models import Category, Question
+
+
+def _send_to_game_managers(event):
+    channel_layer = get_channel_layer()
+    for channel in get_all_shard_channels():
+        try:
+            async_to_sync(channel_layer.send)(channel, event)
+        except (ChannelFull, OSError) as e:
+            # The change is saved anyway, the worker catches up when it loads its pool again (restart or import)
+            print(f"{event['type']} event not delivered to {channel}: {e!r}")
+
+
+def _notify_game_managers(question, deleted):
+    # Questions are edited in the web process, every game worker keeps its own question pool
+    # Sent after the commit, so a worker never draws a rolled back question and the save doesn't wait for Redis
+    event = {
+        "type": "question_changed",
+        "question_id": question.id,
+        "category_id": question.category_id,
+        "difficulty": question.difficulty,
+        "deleted": deleted,
+    }
+    transaction.on_commit(lambda: _send_to_game_managers(event))
+
+
+@receiver(post_save, sender=Question)
+def question_saved(sender, instance, **kwargs):
+    _notify_game_managers(instance, False)
+
+
+@receiver(post_delete, sender=Question)
+def question_deleted(sender, instance, **kwargs):
+    _notify_game_managers(instance, True)
+
+
+def _notify_about_category(category, deleted):
+    # Workers keep names of categories with their question pools
+    event = {
+        "type": "category_changed",
+        "category_id": category.id,
+        "name": category.name,
+        "deleted": deleted,
+    }
+    transaction.on_commit(lambda: _send_to_game_managers(event))
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, **kwargs):
+    _notify_about_category(instance, False)
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    _notify_about_category(instance, True)
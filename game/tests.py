@@ -1,3 +1,774 @@
-from django.test import TestCase
+import asyncio
+import collections
+import functools
+import json
+import random
+import time
+from array import array
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, override_settings
+import msgpack
+
+from game.checks import check_game_codes
+from game.consumers import ChatConsumer
+from game.game_logic import frames
+from game.game_logic.game import Game
+from game.game_logic.game_codes import GameCodeAllocator, GameCodeSpace
+from game.game_logic.game_manager import GameWorker
+from game.game_logic.leaderboard import Leaderboard
+from game.game_logic.question_pool import QuestionPool
+from game.game_logic.scheduler import GameScheduler
+from game.game_logic.state_store import MemoryGameStateStore
+from game.game_logic.usernames import UsernameIndex
+from game.models import Question
+from game.question_bank import InvalidQuestion, validate_row
+from game.rate_limit import TokenBucket
+from game.schemas import InvalidRequest, validate
+
+
+def async_test(test):
+    # SimpleTestCase runs only synchronous test methods
+    @functools.wraps(test)
+    def wrapper(self):
+        async_to_sync(test)(self)
+    return wrapper
+
+
+class StubChannelLayer:
+    """ Keeps messages sent by games instead of delivering them """
+
+    def __init__(self):
+        self.sent = []  # [(channel_name, message), ...]
+        self.group_sent = []  # [(group, message), ...]
+        self.groups = collections.defaultdict(set)
+
+    async def send(self, channel_name, message):
+        self.sent.append((channel_name, message))
+
+    async def group_send(self, group, message):
+        self.group_sent.append((group, message))
+
+    async def group_add(self, group, channel_name):
+        self.groups[group].add(channel_name)
+
+    async def group_discard(self, group, channel_name):
+        self.groups[group].discard(channel_name)
+
+    def get_frames(self, channel_name=None, group=None):
+        # Broadcast events carry the encoded frame, other events become frames in consumers
+        messages = self.sent if group is None else self.group_sent
+        return [json.loads(message['text']) if message['type'] == 'broadcast' else message
+                for target, message in messages if target in (channel_name, group)]
+
+
+def create_game(channel_layer, game_code='000001'):
+    async def on_game_end(game_code):
+        pass
+
+    return Game(game_code, channel_layer, on_game_end, GameScheduler(), MemoryGameStateStore(), history=None)
+
+
+def set_questions(game):
+    # Unsaved questions, games read only their fields
+    game.questions = [Question(id=question_id, content=f'Q{question_id}', answer0='a', answer1='b', answer2='c',
+                               answer3='d', correct_answer=question_id % 4) for question_id in range(3)]
+    game._encode_questions()
+    game.are_questions_prepared = True
+
+
+class SchemasTests(SimpleTestCase):
+    def assertInvalid(self, request, msg):
+        with self.assertRaises(InvalidRequest) as context:
+            validate(request)
+        self.assertEqual(context.exception.msg, msg)
+
+    def test_valid_request(self):
+        self.assertEqual(validate({'type': 'answer', 'question_id': 2, 'answer': 3}),
+                         ('answer', {'question_id': 2, 'answer': 3}))
+
+    def test_malformed_request(self):
+        for request in (None, [], 'join', {}, {'type': None}, {'type': ['x']}, {'type': {}}, {'type': 1}):
+            self.assertInvalid(request, "Malformed request")
+
+    def test_unknown_request_type(self):
+        self.assertInvalid({'type': 'shutdown'}, "Unknown request type")
+
+    def test_integer_answer(self):
+        self.assertEqual(validate({'type': 'answer', 'question_id': 1.0, 'answer': '2'})[1],
+                         {'question_id': 1, 'answer': 2})
+        for answer in (1.9, True, 4, -1, 'a', None, [1], float('inf'), float('nan')):
+            self.assertInvalid({'type': 'answer', 'question_id': 0, 'answer': answer}, "Wrong answer format")
+
+    def test_username(self):
+        self.assertInvalid({'type': 'new_game', 'user': ' '}, "Some data is missing")
+        self.assertInvalid({'type': 'new_game', 'user': 'x' * 31},
+                           "Username can't be longer than 30 characters")
+
+    def test_game_code(self):
+        # Numeric codes lose leading zeros in JSON numbers
+        self.assertEqual(validate({'type': 'join', 'user': 'A', 'game_code': 12})[1]['game_code'], '000012')
+        self.assertInvalid({'type': 'join', 'user': 'A', 'game_code': None}, "Some data is missing")
+
+    def test_optional_game_options(self):
+        self.assertEqual(validate({'type': 'new_game', 'user': 'A'})[1],
+                         {'user': 'A', 'category': None, 'difficulty': None})
+        self.assertEqual(validate({'type': 'new_game', 'user': 'A', 'difficulty': 'Hard'})[1]['difficulty'], 3)
+        self.assertInvalid({'type': 'new_game', 'user': 'A', 'category': ['x']}, "Unknown category")
+
+
+class GameCodeTests(SimpleTestCase):
+    @override_settings(GAME_CODE_LENGTH=12)
+    def test_long_codes_accepted(self):
+        self.assertEqual(validate({'type': 'join', 'user': 'A', 'game_code': 'x' * 12})[1]['game_code'], 'x' * 12)
+        with self.assertRaises(InvalidRequest):
+            validate({'type': 'join', 'user': 'A', 'game_code': 'x' * 13})
+
+    def test_settings_checked(self):
+        self.assertEqual(check_game_codes(None), [])
+        for code_settings in ({'GAME_CODE_LENGTH': 11}, {'GAME_CODE_LENGTH': 0}, {'GAME_CODE_ALPHABET': '0'},
+                              {'GAME_CODE_ALPHABET': 'ABCA'}):
+            with override_settings(**code_settings):
+                self.assertEqual(len(check_game_codes(None)), 1)
+
+    def test_code_space_is_bijection(self):
+        space = GameCodeSpace('0123456789', 3)
+        codes = [space.get_code(index) for index in range(space.size)]
+        self.assertEqual(len(set(codes)), 1000)
+        self.assertTrue(all(len(code) == 3 and code.isdigit() for code in codes))
+        self.assertEqual([space.get_index(code) for code in codes], list(range(space.size)))
+        # Consecutive indexes don't get neighbouring codes
+        self.assertNotEqual(abs(int(codes[1]) - int(codes[0])), 1)
+
+    def test_invalid_codes(self):
+        space = GameCodeSpace('ABCD', 4)
+        for code in (None, 12, 'ABC', 'ABCDA', 'ABCE', 'abcd'):
+            self.assertIsNone(space.get_index(code))
+
+    def test_shards_own_their_codes(self):
+        space = GameCodeSpace('0123456789', 3)
+        allocated = set()
+        for shard in range(3):
+            allocator = GameCodeAllocator(space, shard, 3)
+            codes = [allocator.allocate() for _ in range(allocator.capacity)]
+            self.assertIsNone(allocator.allocate())
+            self.assertTrue(all(space.get_index(code) % 3 == shard for code in codes))
+            allocated.update(codes)
+        self.assertEqual(len(allocated), space.size)
+
+    def test_released_codes_reused_after_fresh_ones(self):
+        allocator = GameCodeAllocator(GameCodeSpace('01', 3), 0, 1)
+        first, second = allocator.allocate(), allocator.allocate()
+        allocator.release(second)
+        allocator.release(first)
+        fresh = [allocator.allocate() for _ in range(6)]
+        self.assertNotIn(first, fresh)
+        self.assertNotIn(second, fresh)
+        # Oldest released code first
+        self.assertEqual([allocator.allocate(), allocator.allocate(), allocator.allocate()], [second, first, None])
+
+    def test_reserved_codes_skipped(self):
+        space = GameCodeSpace('01', 3)
+        allocator = GameCodeAllocator(space, 0, 1)
+        reserved = space.get_code((allocator.start + 1) % space.size)
+        allocator.reserve(reserved)
+        codes = [allocator.allocate() for _ in range(7)]
+        self.assertNotIn(reserved, codes)
+        self.assertEqual(len(set(codes)), 7)
+        self.assertIsNone(allocator.allocate())
+
+
+class LeaderboardTests(SimpleTestCase):
+    def assertMatchesScores(self, leaderboard, scores):
+        for key, score in scores.items():
+            self.assertEqual(leaderboard.get_score(key), score)
+            self.assertEqual(leaderboard.get_rank(key), 1 + sum(other > score for other in scores.values()))
+        for amount in (0, 1, 5, len(scores), len(scores) + 3):
+            top = leaderboard.get_top(amount)
+            self.assertEqual([score for _, score, _ in top], sorted(scores.values(), reverse=True)[:amount])
+            self.assertEqual([rank for _, _, rank in top], [leaderboard.get_rank(key) for key, _, _ in top])
+
+    def test_against_sorting(self):
+        rng = random.Random(1)
+        leaderboard, scores = Leaderboard(300), {}
+        for key in range(60):
+            leaderboard.add(key)
+            scores[key] = 0
+        for _ in range(200):
+            key, points = rng.randrange(60), rng.choice([0, 10, 50])
+            leaderboard.add_score(key, points)
+            scores[key] += points
+        for key in range(0, 60, 7):
+            leaderboard.remove(key)
+            del scores[key]
+        self.assertEqual(len(leaderboard), len(scores))
+        self.assertMatchesScores(leaderboard, scores)
+
+    def test_ties_share_rank(self):
+        leaderboard = Leaderboard(100)
+        for key, score in (('a', 20), ('b', 50), ('c', 20), ('d', 20)):
+            leaderboard.add(key, score)
+        self.assertEqual([leaderboard.get_rank(key) for key in 'abcd'], [2, 1, 2, 2])
+        top = leaderboard.get_top(3)
+        self.assertEqual(top[0], ('b', 50, 1))
+        self.assertEqual([(score, rank) for _, score, rank in top[1:]], [(20, 2), (20, 2)])
+
+    def test_remove(self):
+        leaderboard = Leaderboard(10)
+        leaderboard.add('a', 5)
+        leaderboard.remove('a')
+        self.assertNotIn('a', leaderboard)
+        self.assertEqual(leaderboard.get_top(3), [])
+
+
+class UsernameIndexTests(SimpleTestCase):
+    def test_duplicates_get_suffixes(self):
+        usernames = UsernameIndex()
+        self.assertEqual([usernames.add('Player') for _ in range(3)], ['Player', 'Player #1', 'Player #2'])
+
+    def test_typed_suffixes_skipped(self):
+        usernames = UsernameIndex()
+        usernames.add('Player #1')
+        usernames.add('Player')
+        self.assertEqual(usernames.add('Player'), 'Player #2')
+
+    def test_removed_username_free_again(self):
+        usernames = UsernameIndex()
+        usernames.add('Player')
+        usernames.add('Player')
+        usernames.remove('Player')
+        self.assertEqual(usernames.add('Player'), 'Player')
+        # Released suffixes are not reused
+        usernames.remove('Player #1')
+        self.assertEqual(usernames.add('Player'), 'Player #2')
+
+
+@mock.patch('game.rate_limit.time.monotonic')
+class TokenBucketTests(SimpleTestCase):
+    def test_burst_up_to_capacity(self, monotonic):
+        monotonic.return_value = 100.0
+        bucket = TokenBucket(rate=2, capacity=3)
+        self.assertEqual([bucket.consume() for _ in range(4)], [True, True, True, False])
+
+    def test_refill(self, monotonic):
+        monotonic.return_value = 100.0
+        bucket = TokenBucket(rate=2, capacity=3)
+        for _ in range(3):
+            bucket.consume()
+        monotonic.return_value = 100.5
+        self.assertEqual([bucket.consume(), bucket.consume()], [True, False])
+        # Tokens don't pile up over the capacity
+        monotonic.return_value = 1000.0
+        self.assertEqual([bucket.consume() for _ in range(4)], [True, True, True, False])
+
+
+class QuestionPoolTests(SimpleTestCase):
+    def setUp(self):
+        # Filled without the database, as _load would
+        self.pool = QuestionPool(recent_size=3)
+        self.pool.groups[(None, 1)] = array('i', [1, 2, 3])
+        self.pool.groups[(7, 1)] = array('i', [4, 5])
+        self.pool.groups[(7, 3)] = array('i', [6])
+        self.pool.loaded = True
+
+    def test_sample_by_filter(self):
+        for _ in range(20):
+            self.assertEqual(sorted(self.pool.sample(10)), [1, 2, 3, 4, 5, 6])
+            self.assertEqual(sorted(self.pool.sample(10, category_id=7)), [4, 5, 6])
+            self.assertEqual(sorted(self.pool.sample(10, difficulty=1)), [1, 2, 3, 4, 5])
+            self.assertEqual(self.pool.sample(10, category_id=7, difficulty=3), [6])
+            self.assertEqual(len(set(self.pool.sample(3))), 3)
+        self.assertEqual(self.pool.sample(3, category_id=8), [])
+
+    def test_recent_questions_skipped(self):
+        self.pool._remember([1, 2])
+        for _ in range(20):
+            self.assertIn(self.pool.sample(1, difficulty=1), ([3], [4], [5]))
+        # Served again when a filter has no others
+        self.assertEqual(sorted(self.pool.sample(3, difficulty=1)), [3, 4, 5])
+        self.pool._remember([3, 4, 5])
+        self.assertEqual(self.pool.recent_id_set, {3, 4, 5})
+        self.assertEqual(sorted(self.pool.sample(3, category_id=7)), [4, 5, 6])
+
+    def test_add_keeps_groups_sorted(self):
+        self.pool.add(10, None, 1)
+        self.pool.add(0, None, 1)
+        self.assertEqual(list(self.pool.groups[(None, 1)]), [0, 1, 2, 3, 10])
+        self.pool.add(10, None, 1)
+        self.assertEqual(list(self.pool.groups[(None, 1)]), [0, 1, 2, 3, 10])
+
+    def test_add_moves_question(self):
+        self.pool.add(2, 7, 3)
+        self.assertEqual(list(self.pool.groups[(None, 1)]), [1, 3])
+        self.assertEqual(list(self.pool.groups[(7, 3)]), [2, 6])
+
+    def test_remove(self):
+        self.pool.remove(5)
+        self.pool.remove(99)
+        self.assertEqual(list(self.pool.groups[(7, 1)]), [4])
+        self.assertEqual(sorted(self.pool.sample(10)), [1, 2, 3, 4, 6])
+
+    def test_category_deleted(self):
+        self.pool.change_category(7, 'History')
+        self.pool.change_category(7, 'Old history')
+        self.assertEqual(self.pool.categories, {'Old history': 7})
+        self.pool.change_category(7, 'Old history', deleted=True)
+        self.assertEqual(self.pool.categories, {})
+        self.assertEqual(list(self.pool.groups[(None, 1)]), [1, 2, 3, 4, 5])
+        self.assertEqual(list(self.pool.groups[(None, 3)]), [6])
+
+
+class QuestionPoolLoadTests(SimpleTestCase):
+    def load(self, pool, ids, during_load=None):
+        # ids are [(question_id, category_id, difficulty), ...] read from the database
+        def load_from_database():
+            if during_load:
+                during_load()
+            groups = collections.defaultdict(lambda: array('i'))
+            for question_id, category_id, difficulty in ids:
+                groups[(category_id, difficulty)].append(question_id)
+            return groups, {'History': 7}
+
+        async def run_load():
+            await pool.load()
+
+        with mock.patch.object(pool, '_load', load_from_database):
+            async_to_sync(run_load)()
+
+    def test_changes_before_first_load(self):
+        pool = QuestionPool(recent_size=3)
+        pool.add(5, None, 1)
+        pool.remove(3)
+        self.assertFalse(pool.loaded)
+        self.load(pool, [(1, None, 1), (3, None, 1), (5, None, 1), (7, None, 1)])
+        self.assertTrue(pool.loaded)
+        self.assertEqual(list(pool.groups[(None, 1)]), [1, 3, 5, 7])
+        self.assertEqual(pool.get_category_id('History'), 7)
+
+    def test_changes_during_load_replayed(self):
+        pool = QuestionPool(recent_size=3)
+
+        def during_load():
+            # Changes committed before the ids were read are in them already
+            pool.add(7, None, 1)
+            pool.add(9, None, 1)
+            pool.add(5, 7, 1)
+            pool.remove(3)
+
+        self.load(pool, [(1, None, 1), (3, None, 1), (5, None, 1), (7, None, 1)], during_load)
+        self.assertEqual(list(pool.groups[(None, 1)]), [1, 7, 9])
+        self.assertEqual(list(pool.groups[(7, 1)]), [5])
+
+    def test_current_ids_served_during_reload(self):
+        pool = QuestionPool(recent_size=3)
+        self.load(pool, [(1, None, 1), (2, None, 1)])
+
+        def during_load():
+            self.assertEqual(sorted(pool.sample(5)), [1, 2])
+
+        self.load(pool, [(1, None, 1), (2, None, 1), (3, None, 1)], during_load)
+        self.assertEqual(sorted(pool.sample(5)), [1, 2, 3])
+
+
+class ConsumerFramesTests(SimpleTestCase):
+    """ Frames of ChatConsumer handlers are byte for byte the same as json.dumps of the original handlers """
+
+    def get_frames(self, handler, event, use_msgpack=False):
+        consumer = ChatConsumer({'type': 'websocket'})
+        consumer.use_msgpack = use_msgpack
+        consumer.answered_questions = set()
+        sent = []
+
+        async def base_send(message):
+            sent.append(message)
+
+        consumer.base_send = base_send
+        async_to_sync(getattr(consumer, handler))(event)
+        return sent
+
+    def assertFrame(self, handler, event, expected):
+        self.assertEqual(self.get_frames(handler, event), [{'type': 'websocket.send', 'text': json.dumps(expected)}])
+        binary_frame = self.get_frames(handler, event, use_msgpack=True)[0]['bytes']
+        self.assertEqual(msgpack.unpackb(binary_frame, raw=False), expected)
+
+    def test_game_created(self):
+        self.assertFrame('game_created', {'game_code': '012345'}, {'type': 'game_created', 'code': '012345'})
+
+    def test_join_successful(self):
+        self.assertFrame('join_successful', {'username': 'Żaneta'}, {'type': 'join_successful', 'username': 'Żaneta'})
+
+    def test_error(self):
+        self.assertFrame('error', {'msg': 'Game with code 1 does not exist'},
+                         {'type': 'error', 'msg': 'Game with code 1 does not exist'})
+
+    def test_ask_question(self):
+        answers = ['Paris', 'Lyon', 'Nice', 'Lille']
+        self.assertFrame('ask_question', {'question_id': 2, 'time': 10, 'question': 'Capital of "France"?',
+                                          'answers': answers},
+                         {'type': 'question', 'question_id': 2, 'time': 10, 'question': 'Capital of "France"?',
+                          'answers': answers})
+
+    def test_show_users(self):
+        self.assertFrame('show_users', {'users': ['A', 'B #1']}, {'type': 'users_list', 'users': ['A', 'B #1']})
+
+    def test_question_end(self):
+        self.assertFrame('question_end', {'question_id': 0, 'correct_answer': True},
+                         {'type': 'question_end', 'question_id': 0, 'correct_answer': True})
+
+    def test_game_ended(self):
+        scores = [{'user': 'A', 'score': 1500}, {'user': 'B', 'score': 0}]
+        self.assertFrame('game_ended', {'scores': scores}, {'type': 'quiz_end', 'scores': scores})
+
+    def test_broadcast_encoded_once(self):
+        answers = ['a', 'b', 'c', 'd']
+        event = frames.broadcast_event(frames.question(1, 10, 'Q?', answers))
+        expected = {'type': 'question', 'question_id': 1, 'time': 10, 'question': 'Q?', 'answers': answers}
+        self.assertEqual(self.get_frames('broadcast', event),
+                         [{'type': 'websocket.send', 'text': json.dumps(expected)}])
+        self.assertEqual(self.get_frames('broadcast', event, use_msgpack=True),
+                         [{'type': 'websocket.send', 'bytes': event['bytes']}])
+
+
+class GameSchedulerTests(SimpleTestCase):
+    def setUp(self):
+        self.scheduler = GameScheduler()
+        self.calls = []
+
+    def callback(self, name):
+        async def call():
+            self.calls.append(name)
+        return call
+
+    @async_test
+    async def test_calls_at_deadline(self):
+        now = time.monotonic()
+        self.scheduler.schedule('late', now + 0.2, self.callback('late'))
+        self.scheduler.schedule('early', now + 0.05, self.callback('early'))
+        await asyncio.sleep(0.15)
+        self.assertEqual(self.calls, ['early'])
+        self.assertTrue(self.scheduler.is_scheduled('late'))
+        await asyncio.sleep(0.2)
+        self.assertEqual(self.calls, ['early', 'late'])
+        self.assertFalse(self.scheduler.is_scheduled('late'))
+
+    @async_test
+    async def test_cancel_and_replace(self):
+        now = time.monotonic()
+        self.scheduler.schedule('a', now, self.callback('a'))
+        self.scheduler.cancel('a')
+        self.scheduler.schedule(('game', 'phase'), now, self.callback('first'))
+        self.scheduler.schedule(('game', 'phase'), now + 0.05, self.callback('second'))
+        self.assertEqual(self.scheduler.get_deadline(('game', 'phase')), now + 0.05)
+        await asyncio.sleep(0.2)
+        self.assertEqual(self.calls, ['second'])
+        self.assertIsNone(self.scheduler.get_deadline('a'))
+
+    def test_due_deadlines_batched(self):
+        now = time.monotonic()
+        for key, deadline in (('a', now - 1), ('b', now), ('c', now + 1)):
+            self.scheduler.heap.append([deadline, len(self.scheduler.heap), key, self.callback(key)])
+            self.scheduler.entries[key] = self.scheduler.heap[-1]
+        self.scheduler.cancel('b')
+        self.assertEqual([key for key, _ in self.scheduler._pop_due(now)], ['a'])
+        self.assertEqual(list(self.scheduler.entries), ['c'])
+
+    @async_test
+    async def test_failed_call_doesnt_stop_others(self):
+        async def fail():
+            raise ValueError('broken game')
+
+        now = time.monotonic()
+        self.scheduler.schedule('broken', now, fail)
+        self.scheduler.schedule('ok', now, self.callback('ok'))
+        with mock.patch('builtins.print') as print_mock:
+            await asyncio.sleep(0.15)
+        print_mock.assert_called_once()
+        self.assertEqual(self.calls, ['ok'])
+
+
+    @async_test
+    async def test_game_keys_apart_from_worker_keys(self):
+        # Codes are configurable, a game may get a code equal to a key of the worker
+        game = create_game(StubChannelLayer(), game_code='sweep')
+        game.scheduler = self.scheduler
+        self.scheduler.schedule('sweep', time.monotonic() + 60, self.callback('sweep'))
+        game._schedule(time.monotonic() + 60, self.callback('phase'))
+        self.assertTrue(self.scheduler.is_scheduled('sweep'))
+        game.is_running = True
+        self.assertFalse(game.is_expired(time.monotonic() + 3600, lobby_ttl=60))
+        await game._finish()
+        self.assertTrue(self.scheduler.is_scheduled('sweep'))
+        self.scheduler.cancel('sweep')
+
+class UsersDeltaTests(SimpleTestCase):
+    def setUp(self):
+        self.layer = StubChannelLayer()
+
+    @async_test
+    async def test_joins_sent_as_one_delta(self):
+        game = create_game(self.layer)
+        await game.add_player('specific.a', 'A')
+        await game.add_player('specific.b', 'A')
+        await game._send_users_update()
+        self.assertEqual(self.layer.get_frames(group='000001'), [
+            {'type': 'users_delta', 'from_version': 0, 'version': 1, 'joined': ['A', 'A #1'], 'left': []},
+        ])
+        self.assertEqual(self.layer.groups['000001'], {'specific.a', 'specific.b'})
+        # New players get the whole list with the version of the delta
+        self.assertEqual(self.layer.get_frames('specific.b')[-1],
+                         {'type': 'users_list', 'users': ['A', 'A #1'], 'version': 1})
+
+    @async_test
+    async def test_leaves_and_versions(self):
+        game = create_game(self.layer)
+        await game.add_player('specific.a', 'A')
+        await game.add_player('specific.b', 'B')
+        await game._send_users_update()
+        await game.remove_player('specific.a')
+        await game.add_player('specific.c', 'C')
+        await game._send_users_update()
+        self.assertEqual(self.layer.get_frames(group='000001')[-1],
+                         {'type': 'users_delta', 'from_version': 1, 'version': 2, 'joined': ['C'], 'left': ['A']})
+        self.assertEqual(self.layer.groups['000001'], {'specific.b', 'specific.c'})
+
+    @async_test
+    async def test_player_leaving_before_update_not_announced(self):
+        game = create_game(self.layer)
+        await game.add_player('specific.a', 'A')
+        await game._send_users_update()
+        await game.add_player('specific.b', 'B')
+        await game.remove_player('specific.b')
+        await game._send_users_update()
+        self.assertEqual(len(self.layer.get_frames(group='000001')), 1)
+        self.assertEqual(game.users_version, 1)
+
+    @async_test
+    async def test_update_delayed_by_scheduler(self):
+        game = create_game(self.layer)
+        game.USERS_UPDATE_DELAY = 0.05
+        await game.add_player('specific.a', 'A')
+        await game.add_player('specific.b', 'B')
+        self.assertEqual(self.layer.group_sent, [])
+        await asyncio.sleep(0.2)
+        self.assertEqual([frame['joined'] for frame in self.layer.get_frames(group='000001')], [['A', 'B']])
+
+    @async_test
+    async def test_users_requested(self):
+        game = create_game(self.layer)
+        await game.add_player('specific.a', 'A')
+        # Player not announced yet gets the pending update at once
+        await game.send_list_of_users('specific.a')
+        self.assertEqual(game.users_version, 1)
+        await game.send_list_of_users('specific.a')
+        self.assertEqual(self.layer.get_frames('specific.a')[-1],
+                         {'type': 'users_list', 'users': ['A'], 'version': 1})
+
+
+class ResumeSessionTests(SimpleTestCase):
+    def setUp(self):
+        self.layer = StubChannelLayer()
+
+    async def start_question(self):
+        game = create_game(self.layer)
+        set_questions(game)
+        for channel_name, username in (('specific.a', 'A'), ('specific.b', 'B')):
+            await game.add_player(channel_name, username)
+        await game._send_users_update()
+        game.is_running = True
+        await game._start_question(0, time.monotonic())
+        return game
+
+    @async_test
+    async def test_snapshot_of_question(self):
+        game = await self.start_question()
+        await game.submit_answer('specific.a', 0, 0)
+        session = game._get_player('specific.a').session
+        await game.disconnect_player('specific.a')
+        self.assertEqual(await game.resume_session('specific.a2', session), 'specific.a')
+
+        snapshot = self.layer.get_frames('specific.a2')[-1]
+        self.assertGreater(snapshot.pop('time_left'), Game.QUESTION_LENGTH - 1)
+        self.assertGreater(snapshot.pop('score'), Game.MIN_SCORE)
+        self.assertEqual(snapshot, {
+            'type': 'session_resumed', 'code': '000001', 'username': 'A', 'phase': 'question', 'rank': 1,
+            'question': {'question_id': 0, 'question': 'Q0', 'answers': ['a', 'b', 'c', 'd'], 'answered': True},
+        })
+        # Player keeps the id and the score, only the channel name changes
+        self.assertEqual(game.player_ids, {'specific.a2': 0, 'specific.b': 1})
+        self.assertEqual(self.layer.groups['000001'], {'specific.a2', 'specific.b'})
+        self.assertEqual(game.disconnected_players, set())
+        await game._finish()
+
+    @async_test
+    async def test_snapshot_of_lobby(self):
+        game = create_game(self.layer)
+        await game.add_player('specific.a', 'A')
+        await game.resume_session('specific.a2', game._get_player('specific.a').session)
+        self.assertEqual(self.layer.get_frames('specific.a2')[-1], {
+            'type': 'session_resumed', 'code': '000001', 'username': 'A', 'phase': 'lobby', 'time_left': None,
+            'score': 0, 'rank': 1,
+        })
+
+    @async_test
+    async def test_unknown_session(self):
+        game = await self.start_question()
+        self.assertIsNone(await game.resume_session('specific.c', 'unknown'))
+        self.assertEqual(self.layer.get_frames('specific.c'), [{'type': 'error', 'msg': 'Session expired'}])
+        await game._finish()
+
+
+@override_settings(SPECTATOR_BROADCAST_INTERVAL=0.1)
+class SpectatorsTests(SimpleTestCase):
+    def setUp(self):
+        self.layer = StubChannelLayer()
+
+    def event(self, question_id):
+        return frames.broadcast_event(frames.leaderboard(question_id, []))
+
+    @async_test
+    async def test_broadcasts_throttled(self):
+        game = create_game(self.layer)
+        await game.add_spectator('specific.s')
+        self.assertEqual(self.layer.get_frames('specific.s'), [{'type': 'watch_successful', 'code': '000001'}])
+        await game._send_to_spectators('question', self.event(0))
+        await game._send_to_spectators('reveal', self.event(1))
+        # Waiting event of the same kind is replaced
+        await game._send_to_spectators('leaderboard', self.event(2))
+        await game._send_to_spectators('leaderboard', self.event(3))
+        self.assertEqual([frame['question_id'] for frame in self.layer.get_frames(group='000001.spectators')], [0])
+        await asyncio.sleep(0.25)
+        self.assertEqual([frame['question_id'] for frame in self.layer.get_frames(group='000001.spectators')],
+                         [0, 1, 3])
+
+    @async_test
+    async def test_nothing_sent_without_spectators(self):
+        game = create_game(self.layer)
+        await game._send_to_spectators('question', self.event(0))
+        self.assertEqual(self.layer.group_sent, [])
+        self.assertEqual(game.spectator_events, {})
+
+    @async_test
+    async def test_spectators_are_not_players(self):
+        game = create_game(self.layer)
+        await game.add_player('specific.a', 'A')
+        await game.add_spectator('specific.s')
+        await game._send_users_update()
+        self.assertEqual(game._get_all_usernames(), ['A'])
+        self.assertEqual(self.layer.groups['000001'], {'specific.a'})
+        self.assertEqual(self.layer.groups['000001.spectators'], {'specific.s'})
+
+
+class DrainTests(SimpleTestCase):
+    def setUp(self):
+        self.layer = StubChannelLayer()
+        self.released_leases = []
+        self.worker_events = []
+        with mock.patch('builtins.print'):
+            self.worker = GameWorker({'type': 'channel', 'channel': 'game-manager'})
+        # Started worker, without loading the question pool
+        self.worker.is_started = True
+        self.worker.channel_layer = self.layer
+        self.worker.leases = mock.Mock(release_lease=self.release_lease)
+        self.worker.base_send = self.base_send
+
+    async def release_lease(self, channel, owner):
+        self.released_leases.append(channel)
+
+    async def base_send(self, message):
+        self.worker_events.append(message)
+
+    async def add_game(self, game_code, channel_name):
+        game = self.worker.active_games[game_code] = create_game(self.layer, game_code)
+        game.on_game_end = self.worker._remove_game
+        self.worker.game_codes.reserve(game_code)
+        await self.worker.dispatch({'type': 'add_user', 'game_code': game_code, 'channel_name': channel_name,
+                                    'username': 'A'})
+        return game
+
+    @async_test
+    async def test_new_games_handed_off(self):
+        await self.worker.dispatch({'type': 'worker_standby', 'handoff_channel': 'game-manager.handoff!1'})
+        with mock.patch('builtins.print'):
+            await self.worker.dispatch({'type': 'drain'})
+        await self.worker.dispatch({'type': 'create_game', 'channel_name': 'specific.a', 'username': 'A'})
+        channel, message = self.layer.sent[-1]
+        self.assertEqual(channel, 'game-manager.handoff!1')
+        # Code is allocated by the draining worker, so it doesn't collide with its games
+        self.assertEqual(message['type'], 'create_game')
+        self.assertIn(message['game_code'], self.worker.game_codes.in_use)
+        self.worker.scheduler.cancel('drain')
+
+    @async_test
+    async def test_games_of_draining_worker_handled_here(self):
+        await self.add_game('000001', 'specific.a')
+        await self.worker.dispatch({'type': 'worker_standby', 'handoff_channel': 'game-manager.handoff!1'})
+        with mock.patch('builtins.print'):
+            await self.worker.dispatch({'type': 'drain'})
+        self.layer.sent.clear()
+        await self.worker.dispatch({'type': 'send_users', 'channel_name': 'specific.a'})
+        await self.worker.dispatch({'type': 'add_user', 'game_code': '000001', 'channel_name': 'specific.b',
+                                    'username': 'B'})
+        await self.worker.dispatch({'type': 'add_user', 'game_code': '000002', 'channel_name': 'specific.c',
+                                    'username': 'C'})
+        self.assertEqual([channel for channel, _ in self.layer.sent],
+                         ['specific.a', 'specific.b', 'game-manager.handoff!1'])
+        self.assertEqual(self.worker.current_players, {'specific.a': '000001', 'specific.b': '000001'})
+        self.worker.scheduler.cancel('drain')
+
+    @async_test
+    async def test_drained_after_last_game(self):
+        game = await self.add_game('000001', 'specific.a')
+        with mock.patch('builtins.print'):
+            await self.worker.dispatch({'type': 'drain'})
+            self.assertEqual(self.worker_events, [])
+            await self.worker.dispatch({'type': 'create_game', 'channel_name': 'specific.b', 'username': 'B'})
+            self.assertEqual(self.layer.get_frames('specific.b'),
+                             [{'type': 'error', 'msg': 'Server is restarting, try again in a moment'}])
+            await game.remove_player('specific.a')
+        self.assertEqual(self.released_leases, ['game-manager'])
+        self.assertEqual(self.worker_events, [{'type': 'worker.drained'}])
+        self.assertFalse(self.worker.scheduler.is_scheduled('drain'))
+
+
+class QuestionBankTests(SimpleTestCase):
+    def row(self, correct_answer):
+        return {'content': 'Q?', 'answers': ['a', 'b', 'c', 'd'], 'correct_answer': correct_answer}
+
+    def test_correct_answer(self):
+        for correct_answer, expected in (('2', 2), (3, 3), (1.0, 1)):
+            self.assertEqual(validate_row(self.row(correct_answer))[0].correct_answer, expected)
+
+    def test_invalid_correct_answer(self):
+        for correct_answer in (2.7, True, False, '2.7', None, 4, -1, [1], float('inf'), float('nan')):
+            with self.assertRaises(InvalidQuestion):
+                validate_row(self.row(correct_answer))
+
+
+class QuestionResultsTests(SimpleTestCase):
+    @async_test
+    async def test_failed_sends_dont_stop_game(self):
+        layer = StubChannelLayer()
+        stub_send = layer.send
+
+        async def send(channel_name, message):
+            if channel_name == 'specific.b':
+                raise ConnectionError('Redis is not available')
+            await stub_send(channel_name, message)
+
+        game = create_game(layer)
+        set_questions(game)
+        for channel_name in ('specific.a', 'specific.b', 'specific.c'):
+            await game.add_player(channel_name, channel_name)
+        game.is_running = True
+        layer.send = send
+        with mock.patch('builtins.print') as print_mock:
+            await game._end_question(0, time.monotonic())
+        print_mock.assert_called_once()
+        self.assertEqual(layer.get_frames('specific.a')[-1],
+                         {'type': 'question_end', 'question_id': 0, 'correct_answer': False})
+        self.assertEqual(layer.get_frames('specific.c')[-1]['type'], 'question_end')
+        # Leaderboard is sent and the next question is scheduled
+        self.assertEqual(layer.get_frames(group='000001')[-1]['type'], 'leaderboard')
+        self.assertTrue(game.scheduler.is_scheduled(('000001', 'phase')))
+        await game._finish()
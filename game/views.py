@@ -1,5 +1,30 @@
+import asyncio
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import render
 
+from game import metrics as game_metrics
+from game.game_logic.sharding import get_all_shard_channels
+
 
 def index(request):
     return render(request, 'game/index.html')
+
+
+async def metrics(request):
+    families = game_metrics.registry.collect()
+    # Game workers run in other processes, they send their metrics back on a channel of this request
+    channel_layer = get_channel_layer()
+    reply_channel = await channel_layer.new_channel()
+    shard_channels = get_all_shard_channels()
+    for channel in shard_channels:
+        await channel_layer.send(channel, {"type": "report_metrics", "reply_channel": reply_channel})
+    try:
+        for _ in shard_channels:
+            reply = await asyncio.wait_for(channel_layer.receive(reply_channel), settings.METRICS_WORKER_TIMEOUT)
+            families.extend(reply['families'])
+    except asyncio.TimeoutError:
+        pass
+    return HttpResponse(game_metrics.render(families), content_type='text/plain; version=0.0.4')
@@ -1,6 +1,7 @@
 from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter, ChannelNameRouter
 from game.game_logic.game_manager import GameWorker
+from game.game_logic.sharding import get_all_shard_channels
 import game.routing
 
 application = ProtocolTypeRouter({
@@ -11,6 +12,6 @@ application = ProtocolTypeRouter({
         )
     ),
     'channel': ChannelNameRouter({
-        'game-manager': GameWorker,
+        channel: GameWorker for channel in get_all_shard_channels()
     }),
 })
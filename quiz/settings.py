@@ -39,7 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'game',
+    'game.apps.GameConfig',
     'channels',
 ]
 
@@ -142,11 +142,77 @@ django_heroku.settings(locals())
 ASGI_APPLICATION = 'quiz.routing.application'
 
 
+GAME_REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379')
+
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
-            "hosts": [os.environ.get('REDIS_URL', 'redis://localhost:6379')],
+            "hosts": [GAME_REDIS_URL],
         },
     },
 }
+
+
+# Game workers
+
+# Number of game-manager processes. With more than one shard every worker listens on its own channel:
+# game-manager-0, game-manager-1, ... and each game is handled by the shard owning its code.
+GAME_WORKER_SHARDS = int(os.environ.get('GAME_WORKER_SHARDS', 1))
+
+# Game codes have GAME_CODE_LENGTH characters of GAME_CODE_ALPHABET. Must be the same for the server and all workers.
+# Codes are at most 10 characters long (length of PlayedGame.code), checked by `manage.py check`.
+GAME_CODE_ALPHABET = os.environ.get('GAME_CODE_ALPHABET', '0123456789')
+GAME_CODE_LENGTH = int(os.environ.get('GAME_CODE_LENGTH', 6))
+
+# Number of questions served lately by a game worker, new games get other questions if the filter has enough of them
+RECENT_QUESTIONS_SIZE = 1000
+
+# Number of question results sent to players at the same time
+QUESTION_END_SEND_CONCURRENCY = 100
+# Warn when sending question results takes more than this part of the break between questions
+QUESTION_END_FAN_OUT_WARNING_RATIO = 0.5
+
+# Requests of a single connection are limited by a token bucket: REQUESTS_PER_SECOND with bursts up to REQUESTS_BURST
+CLIENT_REQUESTS_PER_SECOND = 5
+CLIENT_REQUESTS_BURST = 20
+
+# Answers received by a server process within this time (seconds) are sent to the game manager as one message.
+# 0 sends every answer separately.
+ANSWER_BATCH_DELAY = 0.005
+
+# Minimum time between broadcasts to spectators of a game, events of the same kind within it are merged
+SPECTATOR_BROADCAST_INTERVAL = 0.5
+
+# Limits of every game worker, new games and players over them get an error
+MAX_GAMES_PER_WORKER = 10000
+MAX_PLAYERS_PER_GAME = 10000
+# Every GAME_SWEEP_INTERVAL seconds workers remove lobbies nobody joined or left for IDLE_LOBBY_TTL seconds
+# and running games which have no next phase scheduled for STALLED_GAME_TTL seconds
+GAME_SWEEP_INTERVAL = 30
+IDLE_LOBBY_TTL = 30 * 60
+STALLED_GAME_TTL = 60
+
+# Seconds for which players whose connection dropped keep their place in the game and can resume their sessions
+SESSION_GRACE_PERIOD = 30
+
+# On SIGTERM rungameworker drains the worker: running games are finished, new ones go to the standby worker.
+# Drain progress is printed every DRAIN_REPORT_INTERVAL seconds, lobbies idle for DRAINING_LOBBY_TTL are removed.
+DRAIN_REPORT_INTERVAL = 5
+DRAINING_LOBBY_TTL = 60
+
+# Where GameWorker keeps state of games: 'memory' (lost when the worker stops) or 'redis' (resumed by the next worker)
+GAME_STATE_STORE = os.environ.get('GAME_STATE_STORE', 'memory')
+# Seconds after which a standby worker takes over the channel of a worker which stopped responding
+GAME_WORKER_LEASE_TTL = 10
+
+# Finished games are saved in the database by every worker in the background: at most GAME_HISTORY_BATCH_SIZE games
+# in one transaction every GAME_HISTORY_FLUSH_INTERVAL seconds. Games over GAME_HISTORY_QUEUE_SIZE waiting are dropped.
+GAME_HISTORY_QUEUE_SIZE = 10000
+GAME_HISTORY_BATCH_SIZE = 50
+GAME_HISTORY_FLUSH_INTERVAL = 1
+
+# Part of frames logged by consumers at DEBUG level
+FRAME_LOG_SAMPLE_RATE = 0.01
+# Time the metrics endpoint waits for metrics of game workers
+METRICS_WORKER_TIMEOUT = 1